@@ -1,3 +1,65 @@
+import multiprocessing
+import queue
+
+import MongoDB.session as ses
+import instrumentation as inst
+
+# Amount of sampled _ids per range when splitting a collection, see get_split_points()
+SAMPLES_PER_RANGE = 100
+
+def compile_label(label):
+    """Compile a label into a function reading that information from an item
+
+    @params
+    label: a label, either a string or a list of strings for nested information of any depth
+
+    return: function taking an item and returning the information, or None when it is missing
+    """
+    path = tuple(label) if isinstance(label, list) else (label,)
+    if len(path) == 1:
+        key = path[0]
+        def read_label(item):
+            return item.get(key) if isinstance(item, dict) else None
+        return read_label
+    def read_path(item):
+        for key in path:
+            if not isinstance(item, dict):
+                return None
+            item = item.get(key)
+        return item
+    return read_path
+
+def compile_labels(labels):
+    """Compile a list of labels into one function reading all of them from an item
+
+    @params
+    labels: a list containing the labels of the info looked for in the item
+
+    return: function taking an item and returning an array of information corresponding to the labels
+    """
+    readers = [compile_label(label) for label in labels]
+    def read_labels(item):
+        return [read(item) for read in readers]
+    return read_labels
+
+def get_projection(labels):
+    """Create a mongoDB projection containing only the fields needed for the labels
+
+    @params
+    labels: a list containing the labels of the info looked for in the item
+
+    return: projection dict, eg. {'_id': 1, 'order.products': 1}
+    """
+    paths = sorted(('.'.join(label) if isinstance(label, list) else label for label in labels), key=lambda path: path.count('.'))
+    projection = {}
+    for path in paths:
+        parts = path.split('.')
+        if not any('.'.join(parts[:i]) in projection for i in range(1, len(parts))):
+            projection[path] = 1
+    if '_id' not in projection:
+        projection['_id'] = 0
+    return projection
+
 def get_item_information(item, labels):
     """Get array of information from given item, based on labels
     
@@ -7,31 +69,169 @@ def get_item_information(item, labels):
 
     return: array of information from the item, corresponding to the labels 
     """
-    item_info = []
-    for label in labels:
-        if isinstance(label, list):
-            if len(label) == 2:
-                try:
-                    item_info.append(item[label[0]][label[1]])
-                except KeyError:
-                    item_info.append(None)
-                except TypeError:
-                    item_info.append(None)
-            elif len(label) == 3:
-                try:
-                    item_info.append(item[label[0]][label[1]][label[2]])
-                except KeyError:
-                    item_info.append(None)
-                except TypeError:
-                    item_info.append(None)
-        else:
+    return compile_labels(labels)(item)
+
+def iter_collection_information(collection, labels, filters=None, batch_size=10000):
+    """Read information from collection in batches, based on given list of labels
+
+    Unlike get_collection_information() the collection is never loaded as a whole,
+    at most one batch of items is kept in memory at a time.
+    Only the fields needed for the labels are requested from mongoDB.
+    
+    @params
+    collection: a mongoDB collection
+    labels: a list containing the labels of the info looked for in the item
+    filters: OPTIONAL mongoDB query the items have to match
+    batch_size: amount of items per batch, also used as cursor batch size (DEFAULT=10000)
+
+    return: generator of arrays of arrays of information from the items, corresponding to the labels
+    """
+    read_labels = compile_labels(labels)
+    cursor = collection.find(filters, get_projection(labels)).batch_size(batch_size)
+    batch = []
+    for item in cursor:
+        batch.append(read_labels(item))
+        if len(batch) == batch_size:
+            inst.metrics.round_trip('mongodb')
+            yield batch
+            batch = []
+    if batch:
+        inst.metrics.round_trip('mongodb')
+        yield batch
+
+def get_split_points(collection, ranges, filters=None, samples_per_range=SAMPLES_PER_RANGE):
+    """Sample _ids that split a collection into ranges of about the same size
+
+    The _ids of the collection have to be of one type that can be ordered, eg. ObjectIds.
+
+    @params
+    collection: a mongoDB collection
+    ranges: amount of ranges wanted
+    filters: OPTIONAL mongoDB query the items have to match
+    samples_per_range: amount of sampled _ids per range, more gives ranges closer in size (DEFAULT=SAMPLES_PER_RANGE)
+
+    return: sorted list of at most ranges - 1 _ids, the first _id of each range after the first
+    """
+    if ranges <= 1:
+        return []
+    pipeline = [{'$sample': {'size': ranges * samples_per_range}}, {'$project': {'_id': 1}}]
+    if filters:
+        pipeline.insert(0, {'$match': filters})
+    ids = sorted(item['_id'] for item in collection.aggregate(pipeline))
+    inst.metrics.round_trip('mongodb')
+    if not ids:
+        return []
+    return sorted({ids[len(ids) * i // ranges] for i in range(1, ranges)})
+
+def get_range_filters(split_points, filters=None):
+    """Get one query per _id range
+
+    @params
+    split_points: sorted list of _ids, see get_split_points()
+    filters: OPTIONAL mongoDB query the items have to match
+
+    return: list of len(split_points) + 1 mongoDB queries, together matching every item exactly once
+    """
+    bounds = [None] + list(split_points) + [None]
+    range_filters = []
+    for lower, upper in zip(bounds, bounds[1:]):
+        id_range = {}
+        if lower is not None:
+            id_range['$gte'] = lower
+        if upper is not None:
+            id_range['$lt'] = upper
+        range_filter = {'_id': id_range} if id_range else {}
+        if filters and range_filter:
+            range_filter = {'$and': [filters, range_filter]}
+        elif filters:
+            range_filter = filters
+        range_filters.append(range_filter)
+    return range_filters
+
+def read_range(host, port, database_name, collection_name, labels, filters, batch_size, batches):
+    """Read one range of a collection on its own client, used as worker by iter_collection_information_parallel()
+
+    Every batch is put on the batches queue, followed by None when the range is done.
+    When reading fails, the error is put on the queue instead.
+
+    @params
+    host: host of the mongoDB server
+    port: port of the mongoDB server
+    database_name: name of the database
+    collection_name: name of the collection
+    labels: a list containing the labels of the info looked for in the item
+    filters: mongoDB query of the range
+    batch_size: amount of items per batch
+    batches: multiprocessing queue the batches are put on
+    """
+    client = ses.get_client(host=host, port=port)
+    try:
+        collection = ses.get_collection(ses.get_database(client=client, database_name=database_name), collection_name)
+        for batch in iter_collection_information(collection, labels, filters, batch_size):
+            batches.put(batch)
+        batches.put(None)
+    except Exception as error:
+        batches.put(error)
+    finally:
+        client.close()
+
+def iter_collection_information_parallel(collection, labels, filters=None, batch_size=10000, workers=None):
+    """Read information from collection in batches, reading _id ranges in parallel
+
+    The collection is split into one _id range per worker (see get_split_points()),
+    and each range is read and decoded by a worker process with its own mongoDB client.
+    The batches are passed on as soon as any worker has one, so the order of the batches is not fixed.
+    At most two batches per worker wait to be used, so memory use stays flat.
+
+    @params
+    collection: a mongoDB collection with _ids of one type that can be ordered, eg. ObjectIds
+    labels: a list containing the labels of the info looked for in the item
+    filters: OPTIONAL mongoDB query the items have to match
+    batch_size: amount of items per batch (DEFAULT=10000)
+    workers: OPTIONAL amount of worker processes, by default the amount of CPUs, 1 reads without workers
+
+    return: generator of arrays of arrays of information from the items, corresponding to the labels
+    """
+    if workers == None:
+        workers = multiprocessing.cpu_count()
+    if workers <= 1:
+        yield from iter_collection_information(collection, labels, filters, batch_size)
+        return
+    host, port = collection.database.client.address
+    range_filters = get_range_filters(get_split_points(collection, workers, filters), filters)
+    # spawn, so the workers do not inherit the mongoDB client of this process
+    context = multiprocessing.get_context('spawn')
+    batches = context.Queue(maxsize=2 * len(range_filters))
+    processes = [
+        context.Process(target=read_range, args=(host, port, collection.database.name, collection.name, labels, range_filter, batch_size, batches))
+        for range_filter in range_filters
+    ]
+    for process in processes:
+        process.start()
+    try:
+        running = len(processes)
+        stopped = False
+        while running:
             try:
-                item_info.append(item[label])
-            except KeyError:
-                item_info.append(None)
-            except TypeError:
-                item_info.append(None)
-    return item_info
+                batch = batches.get(timeout=1)
+            except queue.Empty:
+                # a worker that was killed never puts None, check twice so batches still underway are not missed
+                if stopped:
+                    raise RuntimeError(f"reading {collection.name} stopped without finishing")
+                stopped = not any(process.is_alive() for process in processes)
+                continue
+            if batch is None:
+                running -= 1
+            elif isinstance(batch, Exception):
+                raise batch
+            else:
+                inst.metrics.round_trip('mongodb')
+                yield batch
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
 
 def get_collection_information(collection, labels, filters=None):
     """Get array of information from collection, based on given list of labels
@@ -39,14 +239,11 @@ def get_collection_information(collection, labels, filters=None):
     @params
     collection: a mongoDB collection
     labels: a list containing the labels of the info looked for in the item
+    filters: OPTIONAL mongoDB query the items have to match
 
     return: array of arrays of information from the item, corresponding to the labels 
     """
     collection_info = []
-    if filters != None:
-        for item in collection.find(filters):
-            collection_info.append(get_item_information(item, labels))
-    else: 
-        for item in collection.find():
-            collection_info.append(get_item_information(item, labels))
+    for batch in iter_collection_information(collection, labels, filters):
+        collection_info.extend(batch)
     return collection_info
@@ -1,19 +1,147 @@
+import threading
+import time
+from contextlib import contextmanager
+
 import psycopg2
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+
+import PostgreSQL.query_stats as stats
 
-def connect_db(host, database, user, password):
+def connect_db(host, database, user, password, query_stats=None):
     """Connect to a PostgreSQL database
 
     @params
     host: string of host 
     database: string of database
     password: string form of database password
+    query_stats: OPTIONAL QueryStats measuring every statement of the connection, see query_stats.py
 
     return: connection
     """
+    if query_stats is None:
+        return psycopg2.connect(
+            host=host,
+            database=database,
+            user=user,
+            password=password
+        )
     connection = psycopg2.connect(
         host=host,
         database=database,
         user=user,
-        password=password
+        password=password,
+        connection_factory=stats.InstrumentedConnection
     )
+    connection.query_stats = query_stats
     return connection
+
+class ConnectionPool:
+    """Thread-safe pool of PostgreSQL connections
+
+    Connections are opened once and reused, instead of connecting for every request.
+    When all connections are in use, a thread waits for one to be returned instead of failing.
+    Connections that have been idle for longer than health_check_interval seconds
+    are checked with a 'SELECT 1' before use, broken connections are replaced.
+
+    @params
+    host: string of host
+    database: string of database
+    user: string of database user
+    password: string form of database password
+    min_connections: amount of connections kept open (DEFAULT=1)
+    max_connections: maximum amount of connections open at the same time (DEFAULT=10)
+    health_check_interval: idle seconds after which a connection is checked before use (DEFAULT=30)
+    timeout: maximum seconds to wait for a free connection, None waits forever (DEFAULT=None)
+    query_stats: OPTIONAL QueryStats measuring every statement of the connections, see query_stats.py
+    """
+    def __init__(self, host, database, user, password, min_connections=1, max_connections=10, health_check_interval=30, timeout=None, query_stats=None):
+        connection_settings = {'host': host, 'database': database, 'user': user, 'password': password}
+        if query_stats is not None:
+            connection_settings['connection_factory'] = stats.InstrumentedConnection
+        self.pool = ThreadedConnectionPool(min_connections, max_connections, **connection_settings)
+        self.query_stats = query_stats
+        self.available = threading.BoundedSemaphore(max_connections)
+        self.health_check_interval = health_check_interval
+        self.timeout = timeout
+        self.last_used = {}
+
+    def is_healthy(self, connection):
+        """Check if a connection can still be used
+
+        @params
+        connection: connection from the pool
+
+        return: True if the connection is usable
+        """
+        if connection.closed:
+            return False
+        if time.monotonic() - self.last_used.get(id(connection), 0) < self.health_check_interval:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            connection.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+    def getconn(self):
+        """Take a healthy connection from the pool, waiting when none is available
+
+        return: connection
+        """
+        if not self.available.acquire(timeout=self.timeout):
+            raise PoolError(f'no connection available within {self.timeout} seconds')
+        try:
+            connection = self.pool.getconn()
+            while not self.is_healthy(connection):
+                self.last_used.pop(id(connection), None)
+                self.pool.putconn(connection, close=True)
+                connection = self.pool.getconn()
+            if self.query_stats is not None:
+                connection.query_stats = self.query_stats
+            return connection
+        except Exception:
+            self.available.release()
+            raise
+
+    def putconn(self, connection, close=False):
+        """Return a connection to the pool
+
+        Open transactions are rolled back by the pool.
+
+        @params
+        connection: connection taken with getconn()
+        close: close the connection instead of reusing it (DEFAULT=False)
+        """
+        close = close or bool(connection.closed)
+        if close:
+            self.last_used.pop(id(connection), None)
+        else:
+            self.last_used[id(connection)] = time.monotonic()
+        try:
+            self.pool.putconn(connection, close=close)
+        finally:
+            self.available.release()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a with block
+
+        return: connection, which is returned to the pool after the block, also on errors
+        """
+        connection = self.getconn()
+        try:
+            yield connection
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self.putconn(connection, close=True)
+            raise
+        except Exception:
+            self.putconn(connection)
+            raise
+        else:
+            self.putconn(connection)
+
+    def close(self):
+        """Close all connections of the pool"""
+        self.pool.closeall()
@@ -0,0 +1,143 @@
+import io
+from itertools import islice
+
+from psycopg2.extras import execute_values
+
+import instrumentation as inst
+
+BATCH_SIZE = 10000
+
+def batched(data, batch_size=BATCH_SIZE):
+    """Split an iterable of datapoints into lists of at most batch_size datapoints
+
+    @params
+    data: any iterable of datapoints
+    batch_size: maximum amount of datapoints per batch
+
+    return: generator of lists of datapoints
+    """
+    iterator = iter(data)
+    batch = list(islice(iterator, batch_size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, batch_size))
+
+def format_copy_value(value):
+    """Format one value for the PostgreSQL COPY text format
+
+    @params
+    value: the value that has to be written
+
+    return: escaped string of value, NULL is written as \\N
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def contains_array(batch):
+    """Check if a batch contains array values, which COPY can not write as is
+
+    @params
+    batch: list of datapoints
+
+    return: True if any value in the batch is a list or tuple
+    """
+    for datapoint in batch:
+        for value in datapoint:
+            if isinstance(value, (list, tuple)):
+                return True
+    return False
+
+def copy_batch(cursor, table, labels, batch):
+    """Write a batch of datapoints using COPY FROM STDIN
+
+    @params
+    cursor: cursor corresponding to required connection
+    table: name of table to insert into
+    labels: list of strings of database labels
+    batch: list of datapoints that are to be inserted
+    """
+    buffer = io.StringIO()
+    for datapoint in batch:
+        buffer.write('\t'.join(format_copy_value(value) for value in datapoint))
+        buffer.write('\n')
+    buffer.seek(0)
+    cursor.copy_expert(f'''COPY {table} ({', '.join(labels)}) FROM STDIN''', buffer)
+
+def values_batch(cursor, table, labels, batch):
+    """Write a batch of datapoints using one multi-row INSERT ... VALUES statement
+
+    Used as fallback for data COPY can not handle, like the array column of content_rule.
+
+    @params
+    cursor: cursor corresponding to required connection
+    table: name of table to insert into
+    labels: list of strings of database labels
+    batch: list of datapoints that are to be inserted
+    """
+    execute_values(cursor, f'''INSERT INTO {table} ({', '.join(labels)}) VALUES %s''', batch, page_size=len(batch))
+
+def bulk_insert(cursor, table, data, labels, batch_size=BATCH_SIZE, use_copy=None):
+    """Insert datapoints into table in batches
+
+    Datapoints are read from data batch by batch, so data can be a list or a generator.
+    Each batch is streamed through COPY FROM STDIN,
+    unless the batch contains arrays, then a multi-row VALUES insert is used instead.
+    The amount of rows and rows/second are reported to the instrumentation (see instrumentation.py).
+
+    @params
+    cursor: cursor corresponding to required connection
+    table: name of table to insert into
+    data: iterable of datapoints that are to be inserted
+    labels: list of strings of database labels
+    batch_size: amount of datapoints written per statement (DEFAULT=BATCH_SIZE)
+    use_copy: OPTIONAL force COPY (True) or VALUES (False), by default this is decided per batch
+
+    return: amount of inserted rows
+    """
+    number_of_rows = 0
+    with inst.metrics.stage(f'insert {table}') as stage:
+        for batch in batched(data, batch_size):
+            if use_copy or (use_copy is None and not contains_array(batch)):
+                copy_batch(cursor, table, labels, batch)
+            else:
+                values_batch(cursor, table, labels, batch)
+            inst.metrics.round_trip('postgresql')
+            number_of_rows += len(batch)
+            stage.add_rows(len(batch))
+    return number_of_rows
+
+def upsert_data(cursor, table, data, labels, conflict_labels, batch_size=BATCH_SIZE):
+    """Insert datapoints into table in batches, updating rows that already exist
+
+    Uses INSERT ... ON CONFLICT DO UPDATE, so the conflict_labels need a primary key or unique index.
+    When a batch contains the same key more than once, the last datapoint is used.
+
+    @params
+    cursor: cursor corresponding to required connection
+    table: name of table to insert into
+    data: iterable of datapoints that are to be inserted
+    labels: list of strings of database labels
+    conflict_labels: list of labels identifying a row, eg. the primary key
+    batch_size: amount of datapoints written per statement (DEFAULT=BATCH_SIZE)
+
+    return: amount of inserted or updated rows
+    """
+    update_labels = [label for label in labels if label not in conflict_labels]
+    if update_labels:
+        action = 'DO UPDATE SET ' + ', '.join(f'{label} = EXCLUDED.{label}' for label in update_labels)
+    else:
+        action = 'DO NOTHING'
+    key_indexes = [labels.index(label) for label in conflict_labels]
+    sql_statement = f'''INSERT INTO {table} ({', '.join(labels)}) VALUES %s ON CONFLICT ({', '.join(conflict_labels)}) {action}'''
+    number_of_rows = 0
+    with inst.metrics.stage(f'upsert {table}') as stage:
+        for batch in batched(data, batch_size):
+            unique_batch = list({tuple(datapoint[i] for i in key_indexes): datapoint for datapoint in batch}.values())
+            execute_values(cursor, sql_statement, unique_batch, page_size=len(unique_batch))
+            inst.metrics.round_trip('postgresql')
+            number_of_rows += len(unique_batch)
+            stage.add_rows(len(unique_batch))
+    return number_of_rows
@@ -0,0 +1,300 @@
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+# Upper bounds in seconds of the latency histogram buckets, the last bucket (+Inf) holds the rest
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Maximum length of a statement shape, longer shapes are cut off
+MAX_SHAPE_LENGTH = 1000
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r'(?<![\w$])-?\d+(?:\.\d+)?\b')
+ARRAY_LITERAL = re.compile(r'ARRAY\[[?,\s]*\]')
+VALUES_LIST = re.compile(r'\([?,\s]*\)(?:\s*,\s*\([?,\s]*\))+')
+WHITESPACE = re.compile(r'\s+')
+PREPARE = re.compile(r'\s*PREPARE\s+(\w+)\s+AS\s+(.*)', re.IGNORECASE | re.DOTALL)
+EXECUTE = re.compile(r'\s*EXECUTE\s+(\w+)', re.IGNORECASE)
+
+def get_shape(query):
+    """Get the shape of a statement, the statement without its values
+
+    Literals become ?, lists of VALUES rows and ARRAY literals are shortened to one,
+    so statements that only differ in their values get the same shape.
+
+    @params
+    query: SQL statement
+
+    return: shape of the statement
+    """
+    shape = STRING_LITERAL.sub('?', query)
+    shape = NUMBER_LITERAL.sub('?', shape)
+    shape = ARRAY_LITERAL.sub('ARRAY[?]', shape)
+    shape = VALUES_LIST.sub(lambda match: match.group(0)[:match.group(0).index(')') + 1] + ', ...', shape)
+    return WHITESPACE.sub(' ', shape).strip()[:MAX_SHAPE_LENGTH]
+
+def escape_label(value):
+    """Escape a Prometheus label value
+
+    @params
+    value: label value
+
+    return: escaped label value
+    """
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class QueryStats:
+    """Counts and latency histograms per statement shape, with a slow query log
+
+    Give it to connect_db() or ConnectionPool to measure every statement of their connections.
+    Statements taking at least slow_threshold seconds are logged as one line of JSON,
+    to slow_query_log or, without it, printed prefixed with 'SLOW QUERY'.
+    A part of the slow SELECT statements, explain_sample_rate, is run again with EXPLAIN (ANALYZE, BUFFERS),
+    at most once per explain_interval seconds per shape, and the plan is added to the log line.
+
+    @params
+    slow_threshold: seconds from which a statement is slow (DEFAULT=0.5)
+    slow_query_log: OPTIONAL path of the file slow statements are appended to
+    explain_sample_rate: part of the slow SELECT statements that is explained, 0 never explains (DEFAULT=0)
+    explain_interval: minimum seconds between two explains of the same shape (DEFAULT=60)
+    buckets: upper bounds in seconds of the latency histogram buckets (DEFAULT=DEFAULT_BUCKETS)
+    """
+    def __init__(self, slow_threshold=0.5, slow_query_log=None, explain_sample_rate=0, explain_interval=60, buckets=DEFAULT_BUCKETS):
+        self.slow_threshold = slow_threshold
+        self.slow_query_log = slow_query_log
+        self.explain_sample_rate = explain_sample_rate
+        self.explain_interval = explain_interval
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.shapes = {}
+        self.last_explained = {}
+
+    def record(self, connection, query, vars, seconds, error=False):
+        """Record one executed statement, used by InstrumentedCursor
+
+        @params
+        connection: InstrumentedConnection the statement was executed on
+        query: SQL statement as given to the cursor
+        vars: parameters of the statement
+        seconds: duration of the statement
+        error: True if the statement failed (DEFAULT=False)
+        """
+        if isinstance(query, bytes):
+            query = query.decode(errors='replace')
+        elif not isinstance(query, str):
+            query = query.as_string(connection)
+        prepare = PREPARE.match(query)
+        execute = EXECUTE.match(query)
+        if prepare and not error:
+            connection.prepared_statements[prepare.group(1)] = prepare.group(2)
+        if execute and execute.group(1) in connection.prepared_statements:
+            # the prepared statement says more about the work than its name
+            shape = get_shape(connection.prepared_statements[execute.group(1)])
+        else:
+            shape = get_shape(query)
+        with self.lock:
+            stats = self.shapes.get(shape)
+            if stats is None:
+                stats = {"count": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0, "buckets": [0] * (len(self.buckets) + 1)}
+                self.shapes[shape] = stats
+            stats["count"] += 1
+            stats["errors"] += error
+            stats["seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+            bucket = 0
+            while bucket < len(self.buckets) and seconds > self.buckets[bucket]:
+                bucket += 1
+            stats["buckets"][bucket] += 1
+            explain = not error and seconds >= self.slow_threshold and self.should_explain(shape)
+        if seconds >= self.slow_threshold:
+            entry = {"time": time.time(), "seconds": round(seconds, 6), "shape_id": get_shape_id(shape), "statement": shape, "error": error}
+            if explain and self.is_select(connection, query):
+                entry["plan"] = self.explain(connection, query, vars)
+            self.log_slow_query(entry)
+
+    def should_explain(self, shape):
+        """Decide if a slow statement is explained, call while holding the lock
+
+        @params
+        shape: shape of the statement
+
+        return: True if it is explained
+        """
+        if self.explain_sample_rate <= 0 or random.random() >= self.explain_sample_rate:
+            return False
+        now = time.monotonic()
+        if shape in self.last_explained and now - self.last_explained[shape] < self.explain_interval:
+            return False
+        self.last_explained[shape] = now
+        return True
+
+    def is_select(self, connection, query):
+        """Check if running a statement again does not change any data
+
+        @params
+        connection: InstrumentedConnection the statement was executed on
+        query: SQL statement
+
+        return: True for SELECT statements and prepared SELECT statements
+        """
+        execute = EXECUTE.match(query)
+        if execute:
+            query = connection.prepared_statements.get(execute.group(1), '')
+        return query.lstrip().upper().startswith('SELECT')
+
+    def explain(self, connection, query, vars):
+        """Run a statement again with EXPLAIN (ANALYZE, BUFFERS)
+
+        Runs in a savepoint on a plain cursor, so a failing explain does not abort the transaction,
+        and the explain itself is not measured.
+
+        @params
+        connection: InstrumentedConnection the statement was executed on
+        query: SQL statement
+        vars: parameters of the statement
+
+        return: plan as JSON, or dict with the error
+        """
+        with connection.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
+            in_transaction = not connection.autocommit
+            try:
+                if in_transaction:
+                    cursor.execute('SAVEPOINT query_stats_explain')
+                cursor.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + query, vars)
+                plan = cursor.fetchone()[0]
+                if in_transaction:
+                    cursor.execute('RELEASE SAVEPOINT query_stats_explain')
+                return plan
+            except psycopg2.Error as error:
+                if in_transaction:
+                    cursor.execute('ROLLBACK TO SAVEPOINT query_stats_explain')
+                return {"error": str(error).strip()}
+
+    def log_slow_query(self, entry):
+        """Write one slow statement to the slow query log
+
+        @params
+        entry: dict describing the statement
+        """
+        line = json.dumps(entry, default=str)
+        if self.slow_query_log is None:
+            print('SLOW QUERY ' + line)
+            return
+        with self.lock, open(self.slow_query_log, 'a') as file:
+            file.write(line + '\n')
+
+    def summary(self):
+        """Get the measurements per shape
+
+        return: list of dicts with shape_id, statement, count, errors, seconds, mean_seconds and max_seconds,
+            the shapes taking the most time first
+        """
+        with self.lock:
+            shapes = [(shape, dict(stats)) for shape, stats in self.shapes.items()]
+        summary = []
+        for shape, stats in shapes:
+            summary.append({
+                "shape_id": get_shape_id(shape),
+                "statement": shape,
+                "count": stats["count"],
+                "errors": stats["errors"],
+                "seconds": round(stats["seconds"], 6),
+                "mean_seconds": round(stats["seconds"] / stats["count"], 6),
+                "max_seconds": round(stats["max_seconds"], 6),
+            })
+        return sorted(summary, key=lambda stats: stats["seconds"], reverse=True)
+
+    def render_prometheus(self):
+        """Render the measurements in the Prometheus text format
+
+        return: string with a histogram (postgresql_query_duration_seconds) and error counter per shape
+        """
+        with self.lock:
+            shapes = [(shape, dict(stats, buckets=list(stats["buckets"]))) for shape, stats in self.shapes.items()]
+        lines = [
+            '# HELP postgresql_query_duration_seconds Duration of PostgreSQL statements per statement shape.',
+            '# TYPE postgresql_query_duration_seconds histogram',
+        ]
+        for shape, stats in shapes:
+            labels = f'shape_id="{get_shape_id(shape)}",statement="{escape_label(shape[:200])}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), stats["buckets"]):
+                cumulative += count
+                lines.append(f'postgresql_query_duration_seconds_bucket{{{labels},le="{"+Inf" if bound == float("inf") else bound}"}} {cumulative}')
+            lines.append(f'postgresql_query_duration_seconds_sum{{{labels}}} {stats["seconds"]}')
+            lines.append(f'postgresql_query_duration_seconds_count{{{labels}}} {stats["count"]}')
+        lines.append('# HELP postgresql_query_errors_total Failed PostgreSQL statements per statement shape.')
+        lines.append('# TYPE postgresql_query_errors_total counter')
+        for shape, stats in shapes:
+            lines.append(f'postgresql_query_errors_total{{shape_id="{get_shape_id(shape)}"}} {stats["errors"]}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """Write the measurements to a file in the Prometheus text format, eg. for the node_exporter textfile collector
+
+        The file is replaced atomically, so a scrape never reads half a file.
+
+        @params
+        path: path of the file
+        """
+        temporary_path = f'{path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'w') as file:
+            file.write(self.render_prometheus())
+        os.replace(temporary_path, path)
+
+    def reset(self):
+        """Drop all measurements"""
+        with self.lock:
+            self.shapes = {}
+            self.last_explained = {}
+
+def get_shape_id(shape):
+    """Get a short id of a statement shape, to find it back in the slow query log and metrics
+
+    @params
+    shape: shape of a statement, see get_shape()
+
+    return: 12 character hex id
+    """
+    return hashlib.md5(shape.encode()).hexdigest()[:12]
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """Cursor reporting the duration of every statement to the QueryStats of its connection"""
+    def measure(self, query, vars, function, *args):
+        start = time.perf_counter()
+        error = True
+        try:
+            result = function(*args)
+            error = False
+            return result
+        finally:
+            query_stats = getattr(self.connection, 'query_stats', None)
+            if query_stats is not None:
+                query_stats.record(self.connection, query, vars, time.perf_counter() - start, error)
+
+    def execute(self, query, vars=None):
+        return self.measure(query, vars, super().execute, query, vars)
+
+    def executemany(self, query, vars_list):
+        return self.measure(query, None, super().executemany, query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        return self.measure(sql, None, super().copy_expert, sql, file, size)
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """Connection of which the cursors are InstrumentedCursors, see connect_db()
+
+    query_stats is the QueryStats the statements are reported to, None measures nothing.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cursor_factory = InstrumentedCursor
+        self.query_stats = None
+        self.prepared_statements = {}
@@ -1,16 +1,80 @@
-def postgresql_select(cursor, items, table, filters=None):
+import hashlib
+import re
+import weakref
+
+import instrumentation as inst
+
+# Names of the statements prepared on each connection, entries disappear with their connection
+prepared_statements = weakref.WeakKeyDictionary()
+
+PLACEHOLDER = re.compile(r'%\((\w+)\)s|%s|%%')
+
+def to_positional(sql_statement):
+    """Convert psycopg2 placeholders into PostgreSQL positional parameters
+
+    Both %s and %(name)s placeholders are supported, a name used more than once gets one parameter.
+
+    @params
+    sql_statement: SQL statement with psycopg2 placeholders
+
+    return: tuple of (statement with $1, $2, ... placeholders, list of parameter names, None for %s)
+    """
+    names = []
+    def replace(match):
+        if match.group(0) == '%%':
+            return '%'
+        name = match.group(1)
+        if name is not None and name in names:
+            return f'${names.index(name) + 1}'
+        names.append(name)
+        return f'${len(names)}'
+    return PLACEHOLDER.sub(replace, sql_statement), names
+
+def execute_prepared(cursor, sql_statement, params=None):
+    """Execute a statement as prepared statement
+
+    The first time a statement (query shape) is executed on a connection it is prepared,
+    after that the prepared statement is reused, so PostgreSQL does not parse and plan it again.
+
+    @params
+    cursor: cursor for given connection
+    sql_statement: SQL statement with %s or %(name)s placeholders
+    params: OPTIONAL list of parameters for %s, or dict of parameters for %(name)s
+    """
+    statements = prepared_statements.setdefault(cursor.connection, set())
+    positional_statement, names = to_positional(sql_statement)
+    name = 'statement_' + hashlib.md5(positional_statement.encode()).hexdigest()[:16]
+    if name not in statements:
+        cursor.execute(f'PREPARE {name} AS {positional_statement}')
+        inst.metrics.round_trip('postgresql')
+        statements.add(name)
+    inst.metrics.round_trip('postgresql')
+    if not names:
+        cursor.execute(f'EXECUTE {name}')
+        return
+    if isinstance(params, dict):
+        params = [params[parameter] for parameter in names]
+    cursor.execute(f'''EXECUTE {name} ({', '.join(['%s'] * len(names))})''', params)
+
+def postgresql_select(cursor, items, table, filters=None, params=None):
     """excecutes select command based on parameters
-    
+
     @params
     cursor: cursor for given connection
     items: items you want to select, in the form of an array of strings
     table: string corresponding to table
     filters: OPTIONAL let you use the where statement, in the form of array of strings
-    
+    params: OPTIONAL parameters for %s placeholders in filters, eg. filters=["product_id = %s"], params=[id]
+        with params the statement is prepared once per connection and reused (see execute_prepared())
+
     returns result of statement
     """
-    sql_statement = f'''SELECT {', '.join(items)} FROM {table}''' 
+    sql_statement = f'''SELECT {', '.join(items)} FROM {table}'''
     if filters != None:
         sql_statement += f''' Where {' and '.join(filters)}'''
-    cursor.execute(sql_statement)
-    return cursor.fetchall()
\ No newline at end of file
+    if params != None:
+        execute_prepared(cursor, sql_statement, params)
+    else:
+        cursor.execute(sql_statement)
+        inst.metrics.round_trip('postgresql')
+    return cursor.fetchall()
@@ -0,0 +1,244 @@
+###################################################################
+#                                                                 #
+#   Use this file to get recommendations from async code          #
+#                                                                 #
+#   Same recommendations as recommendation_engine.py, on asyncpg  #
+#   instead of psycopg2, so a request does not block a thread.    #
+#                                                                 #
+###################################################################
+
+import asyncio
+import time
+
+import asyncpg
+
+import PostgreSQL.select as sel
+import request_coalescer as coalesce
+import recommendation_cache as cache
+import recommendation_engine as engine
+import exclusion_filter as exclusion
+
+class AsyncRecommendationService(engine.RecommendationServiceBase):
+    """Long-lived recommendation service for asyncio
+
+    Works like RecommendationService in recommendation_engine.py, with an asyncpg connection pool.
+    Concurrent requests are combined (see request_coalescer.py): requests for the same recommendations share one query,
+    and requests arriving within batch_window seconds are resolved in one ANY(...) query,
+    so a burst of requests does not need a connection per request.
+    asyncpg prepares each statement once per connection.
+
+    Use as async with block, or call open() before and close() after use.
+
+    @params
+    host: string of host (DEFAULT=localhost)
+    database: string of database (DEFAULT=opisop_sql)
+    user: string of database user (DEFAULT=postgres)
+    password: string form of database password (DEFAULT=postgres)
+    min_connections: amount of connections kept open (DEFAULT=1)
+    max_connections: maximum amount of connections open at the same time (DEFAULT=10)
+    cache_size: maximum amount of cached recommendations per type, 0 disables caching (DEFAULT=10000)
+    cache_ttl: seconds a cached recommendation stays valid (DEFAULT=300)
+    version_check_interval: seconds between checks for regenerated data (DEFAULT=5)
+    batch_window: seconds requests are collected before they are queried together (DEFAULT=coalesce.BATCH_WINDOW)
+    max_batch_size: maximum amount of ids per query (DEFAULT=coalesce.MAX_BATCH_SIZE)
+    profile_model: OPTIONAL ProfileModel used for profile recommendations
+    exclusion_filter: OPTIONAL ExclusionFilter with the products to leave out per profile
+    """
+    def __init__(self, host='localhost', database='opisop_sql', user='postgres', password='postgres', min_connections=1, max_connections=10,
+                 cache_size=10000, cache_ttl=300, version_check_interval=5, batch_window=coalesce.BATCH_WINDOW, max_batch_size=coalesce.MAX_BATCH_SIZE, profile_model=None, exclusion_filter=None):
+        self.connection_settings = {'host': host, 'database': database, 'user': user, 'password': password, 'min_size': min_connections, 'max_size': max_connections}
+        self.pool = None
+        self.open_lock = asyncio.Lock()
+        self.content_cache = cache.RecommendationCache(cache_size, cache_ttl)
+        self.profile_cache = cache.RecommendationCache(cache_size, cache_ttl)
+        self.version_check_interval = version_check_interval
+        self.version_checked = None
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.profile_model = profile_model
+        self.exclusion_filter = exclusion_filter
+        self.content_coalescers = {}
+        self.profile_coalescers = {}
+        self.content_statement = sel.to_positional(engine.CONTENT_RECOMMENDATIONS_BATCH_STATEMENT)
+        self.profile_statement = sel.to_positional(engine.PROFILE_RECOMMENDATIONS_BATCH_STATEMENT)
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.close()
+        return False
+
+    async def open(self):
+        """Open the connection pool, does nothing when it is already open"""
+        async with self.open_lock:
+            if self.pool is None:
+                self.pool = await asyncpg.create_pool(**self.connection_settings)
+
+    async def close(self):
+        """Close all connections of the service"""
+        async with self.open_lock:
+            if self.pool is not None:
+                await self.pool.close()
+                self.pool = None
+
+    async def fetch(self, statement, params):
+        """Run a statement converted by sel.to_positional()
+
+        @params
+        statement: tuple of (statement, parameter names)
+        params: dict of parameters
+
+        return: list of records
+        """
+        if self.pool is None:
+            await self.open()
+        sql_statement, names = statement
+        return await self.pool.fetch(sql_statement, *[params[name] for name in names])
+
+    async def check_versions(self):
+        """Drop cached recommendations when the data behind them has been regenerated
+
+        The versions are read from PostgreSQL at most once per version_check_interval seconds.
+        """
+        now = time.monotonic()
+        if self.version_checked is not None and now - self.version_checked < self.version_check_interval:
+            return
+        self.version_checked = now
+        self.set_versions(dict(await self.fetch((cache.VERSIONS_QUERY, []), {})))
+
+    async def get_coalesced(self, coalescers, key, fetch_batch, id):
+        """Get the result for one id through the Coalescer of key, see request_coalescer.py
+
+        A Coalescer is made on first use and dropped again once nothing is in flight,
+        so the amounts chosen by callers do not pile up Coalescers.
+
+        @params
+        coalescers: dict of {key: Coalescer}, eg. content_coalescers
+        key: key of the Coalescer, the amounts of the request
+        fetch_batch: async function getting a list of ids and returning a dict of {id: result}
+        id: the id to fetch
+
+        return: result of fetch_batch for id, None if it returned nothing for it
+        """
+        coalescer = coalescers.get(key)
+        if coalescer is None:
+            coalescer = coalesce.Coalescer(fetch_batch, self.batch_window, self.max_batch_size)
+            coalescers[key] = coalescer
+        try:
+            return await coalescer.get(id)
+        finally:
+            if not coalescer.in_flight and coalescers.get(key) is coalescer:
+                del coalescers[key]
+
+    async def fetch_content_batch(self, product_ids, ammount):
+        """Query content recommendations for a batch of products
+
+        @params
+        product_ids: list of product_ids that need recommendations
+        amount: the maximum amount of recommendations returned per product
+
+        returns: dict of {product_id: list of recommended product ids}
+        """
+        records = await self.fetch(self.content_statement, {"product_ids": product_ids, "amount": ammount})
+        return {record[0]: list(record[1] or []) for record in records}
+
+    async def fetch_profile_batch(self, profile_ids, comparative_user_ammount, recommendation_amount):
+        """Query profile recommendations for a batch of profiles
+
+        @params
+        profile_ids: list of ids of the users that need recommendations
+        comparative_user_amounts: the amount of users each profile is compared to
+        recommendation_amount: amount of products returned per profile
+
+        return: dict of {profile_id: list of product ids}
+        """
+        records = await self.fetch(self.profile_statement, {"profile_ids": profile_ids, "comparative_user_amount": comparative_user_ammount, "recommendation_amount": recommendation_amount})
+        return {record[0]: list(record[1] or []) for record in records}
+
+    async def get_content_recommendations(self, product_id, ammount, profile_id=None):
+        """Retrieve content recommendation, see recommendation_engine.get_content_recommendations()
+
+        @params
+        product_id: product_id for the product that needs recommendations
+        amount: the maximum amount of recommendations returned
+        profile_id: OPTIONAL id of the user the recommendations are for, products in its history are left out
+
+        returns: list of product ids corresponding to the request
+        """
+        excluded = self.get_excluded(profile_id)
+        fetch_amount = exclusion.get_fetch_amount(ammount, excluded)
+        recommended_product_ids = await self.fetch_content_recommendations(product_id, fetch_amount)
+        recommendations = exclusion.exclude(recommended_product_ids, excluded, ammount)
+        if exclusion.needs_more(recommended_product_ids, recommendations, fetch_amount, ammount, excluded):
+            # the worst case is rare and differs per profile, so it is fetched on its own instead of through a coalescer
+            recommended_product_ids = (await self.fetch_content_batch([product_id], ammount + len(excluded))).get(product_id) or []
+            recommendations = exclusion.exclude(recommended_product_ids, excluded, ammount)
+        return recommendations
+
+    async def fetch_content_recommendations(self, product_id, ammount):
+        """Get content recommendation from the cache or a coalesced query, without leaving products out
+
+        @params
+        product_id: product_id for the product that needs recommendations
+        amount: the maximum amount of recommendations returned
+
+        returns: list of product ids
+        """
+        await self.check_versions()
+        key = (product_id, ammount)
+        recommended_product_ids = self.content_cache.get(key)
+        if recommended_product_ids is cache.MISSING:
+            version = self.content_cache.version
+            fetch_batch = lambda product_ids: self.fetch_content_batch(product_ids, ammount)
+            recommended_product_ids = await self.get_coalesced(self.content_coalescers, ammount, fetch_batch, product_id) or []
+            self.content_cache.put(key, recommended_product_ids, version)
+        return list(recommended_product_ids)
+
+    async def get_profile_recommendations(self, profile_id, comparative_user_ammount, recommendation_amount):
+        """get recomendation for given profile, see recommendation_engine.get_profile_recommendations()
+
+        @params
+        profile_id: the id of the user that needs recommendations
+        comparative_user_amounts: the amount of users the profile is compared to
+        recommendation_amount: amount of products returned at the end
+
+        return: list of product ids with the maximal length of 'recommendation_amount'
+        """
+        excluded = self.get_excluded(profile_id)
+        fetch_amount = exclusion.get_fetch_amount(recommendation_amount, excluded)
+        recommended_product_ids = await self.fetch_profile_recommendations(profile_id, comparative_user_ammount, fetch_amount)
+        recommendations = exclusion.exclude(recommended_product_ids, excluded, recommendation_amount)
+        if exclusion.needs_more(recommended_product_ids, recommendations, fetch_amount, recommendation_amount, excluded):
+            recommended_product_ids = await self.fetch_profile_recommendations(profile_id, comparative_user_ammount, recommendation_amount + len(excluded), batched=False)
+            recommendations = exclusion.exclude(recommended_product_ids, excluded, recommendation_amount)
+        return recommendations
+
+    async def fetch_profile_recommendations(self, profile_id, comparative_user_ammount, recommendation_amount, batched=True):
+        """Get profile recommendations from the cache, the profile model or a coalesced query, without leaving products out
+
+        @params
+        profile_id: the id of the user that needs recommendations
+        comparative_user_amounts: the amount of users the profile is compared to
+        recommendation_amount: amount of products returned at the end
+        batched: combine the query with concurrent requests, False queries this profile on its own (DEFAULT=True)
+
+        return: list of product ids
+        """
+        await self.check_versions()
+        key = (profile_id, comparative_user_ammount, recommendation_amount)
+        recommended_product_ids = self.profile_cache.get(key)
+        if recommended_product_ids is cache.MISSING and self.profile_model is not None:
+            recommended_product_ids = self.profile_model.recommend(profile_id, comparative_user_ammount, recommendation_amount)
+            self.profile_cache.put(key, recommended_product_ids)
+        elif recommended_product_ids is cache.MISSING and not batched:
+            version = self.profile_cache.version
+            recommended_product_ids = (await self.fetch_profile_batch([profile_id], comparative_user_ammount, recommendation_amount)).get(profile_id) or []
+            self.profile_cache.put(key, recommended_product_ids, version)
+        elif recommended_product_ids is cache.MISSING:
+            version = self.profile_cache.version
+            fetch_batch = lambda profile_ids: self.fetch_profile_batch(profile_ids, comparative_user_ammount, recommendation_amount)
+            recommended_product_ids = await self.get_coalesced(self.profile_coalescers, (comparative_user_ammount, recommendation_amount), fetch_batch, profile_id) or []
+            self.profile_cache.put(key, recommended_product_ids, version)
+        return list(recommended_product_ids)
@@ -0,0 +1,188 @@
+#####################################################################
+#                                                                   #
+#   Use this file to fill a MongoDB database with synthetic data    #
+#                                                                   #
+#   The documents have the same shape as the opisop collections     #
+#   read by fill_database_table.py: products, visitors and          #
+#   sessions. Product popularity is skewed, a few documents miss    #
+#   fields or hold faulty ids, like the real data does.             #
+#                                                                   #
+#####################################################################
+
+import random
+
+from bson import ObjectId
+
+import MongoDB.session as ses
+
+# Amount of sessions per scale, the amount of products and visitors follow from it
+SCALES = {
+    "10k": 10000,
+    "100k": 100000,
+    "1m": 1000000,
+    "10m": 10000000,
+}
+
+# Amount of documents per insert_many
+INSERT_BATCH_SIZE = 10000
+
+BRANDS = [f"brand {i}" for i in range(200)]
+CATEGORIES = [f"category {i}" for i in range(30)]
+SUB_CATEGORIES = [f"sub_category {i}" for i in range(8)]
+
+def get_sizes(sessions):
+    """Get the amount of documents per collection for an amount of sessions
+
+    @params
+    sessions: amount of sessions
+
+    return: dict with the amount of products, visitors and sessions
+    """
+    return {
+        "products": max(100, sessions // 20),
+        "visitors": max(100, sessions // 3),
+        "sessions": sessions,
+    }
+
+def get_popularity(amount, skew=1.1):
+    """Get cumulative weights giving item i a chance proportional to 1 / (i + 1) ** skew
+
+    @params
+    amount: amount of items
+    skew: how much more popular the first items are (DEFAULT=1.1)
+
+    return: list of cumulative weights, for random.choices()
+    """
+    cumulative_weights = []
+    total = 0.0
+    for i in range(amount):
+        total += 1 / (i + 1) ** skew
+        cumulative_weights.append(total)
+    return cumulative_weights
+
+def generate_products(amount, rng):
+    """Generate product documents
+
+    @params
+    amount: amount of products
+    rng: random.Random used for all choices
+
+    return: generator of product documents
+    """
+    for i in range(amount):
+        product = {"_id": str(10000 + i), "herhaalaankopen": rng.random() < 0.2, "fast_mover": rng.random() < 0.1}
+        # some products miss their brand or category, these get no content recommendations
+        if rng.random() < 0.95:
+            product["brand"] = rng.choice(BRANDS)
+            product["category"] = rng.choice(CATEGORIES)
+            product["sub_category"] = rng.choice(SUB_CATEGORIES)
+        product["properties"] = {"stock": str(rng.randint(0, 500)), "discount": rng.choice([None, "10%", "1+1 gratis"])}
+        yield product
+
+def generate_visitors(amount, product_ids, rng):
+    """Generate visitor documents
+
+    The BUIDs of a visitor can be found back in generate_sessions() with the same seed.
+
+    @params
+    amount: amount of visitors
+    product_ids: list of all product ids
+    rng: random.Random used for all choices
+
+    return: generator of visitor documents
+    """
+    popularity = get_popularity(len(product_ids))
+    for i in range(amount):
+        visitor = {"_id": ObjectId(), "buids": get_buids(i)}
+        # some visitors have no history at all
+        if rng.random() < 0.8:
+            visitor["previously_recommended"] = rng.choices(product_ids, cum_weights=popularity, k=rng.randint(0, 10))
+            visitor["recommendations"] = {"viewed_before": rng.choices(product_ids, cum_weights=popularity, k=rng.randint(0, 10))}
+            if rng.random() < 0.01: # faulty product id, longer than 32 characters
+                visitor["previously_recommended"].append("x" * 40)
+        # and some have no BUIDs
+        if rng.random() < 0.05:
+            visitor["buids"] = None
+        yield visitor
+
+def get_buids(visitor_number):
+    """Get the BUIDs of a visitor
+
+    @params
+    visitor_number: index of the visitor
+
+    return: list of BUIDs
+    """
+    return [f"buid-{visitor_number}-{i}" for i in range(1 + visitor_number % 2)]
+
+def generate_sessions(amount, visitors, product_ids, rng):
+    """Generate session documents
+
+    @params
+    amount: amount of sessions
+    visitors: amount of visitors the sessions belong to
+    product_ids: list of all product ids
+    rng: random.Random used for all choices
+
+    return: generator of session documents
+    """
+    popularity = get_popularity(len(product_ids))
+    for i in range(amount):
+        has_sale = rng.random() < 0.6
+        session = {"_id": ObjectId(), "buid": [rng.choice(get_buids(rng.randrange(visitors)))], "has_sale": has_sale}
+        if has_sale:
+            session["order"] = {"products": [{"id": product_id} for product_id in rng.choices(product_ids, cum_weights=popularity, k=rng.randint(1, 6))]}
+        yield session
+
+def insert_documents(collection, documents, batch_size=INSERT_BATCH_SIZE):
+    """Insert documents into a collection in batches
+
+    @params
+    collection: MongoDB collection
+    documents: iterable of documents
+    batch_size: amount of documents per insert_many (DEFAULT=INSERT_BATCH_SIZE)
+
+    return: amount of inserted documents
+    """
+    batch = []
+    inserted = 0
+    for document in documents:
+        batch.append(document)
+        if len(batch) == batch_size:
+            collection.insert_many(batch, ordered=False)
+            inserted += len(batch)
+            batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+        inserted += len(batch)
+    return inserted
+
+def generate_database(mongo_database, sessions, seed=0):
+    """Drop and fill the products, visitors and sessions collections of a database
+
+    @params
+    mongo_database: MongoDB database, use a separate database for benchmarks
+    sessions: amount of sessions, see SCALES
+    seed: seed of the random data, the same seed gives the same data (DEFAULT=0)
+
+    return: dict with the amount of documents per collection
+    """
+    rng = random.Random(seed)
+    sizes = get_sizes(sessions)
+    product_ids = [str(10000 + i) for i in range(sizes["products"])]
+    collections = {
+        "products": generate_products(sizes["products"], rng),
+        "visitors": generate_visitors(sizes["visitors"], product_ids, rng),
+        "sessions": generate_sessions(sizes["sessions"], sizes["visitors"], product_ids, rng),
+    }
+    for collection_name, documents in collections.items():
+        collection = ses.get_collection(mongo_database, collection_name)
+        collection.drop()
+        print(f"generating {sizes[collection_name]} {collection_name}")
+        insert_documents(collection, documents)
+    return sizes
+
+if __name__ == '__main__':
+    # Use a separate database, the collections in it are dropped
+    mongo_database = ses.get_database(client=ses.get_client(host="Localhost", port=27017), database_name="opisop_benchmark")
+    generate_database(mongo_database, SCALES["10k"])
@@ -0,0 +1,291 @@
+#####################################################################
+#                                                                   #
+#   Use this file to benchmark the ETL and the recommendations      #
+#                                                                   #
+#   Run from the root of the repository, eg.                        #
+#       python -m benchmark.run_benchmark --scale 100k              #
+#   Results are saved as JSON in benchmark/results, pass            #
+#   --compare with an earlier result to see what changed.           #
+#                                                                   #
+#   NOTE: all tables in the benchmark PostgreSQL database and       #
+#   all collections in the benchmark MongoDB database are dropped.  #
+#                                                                   #
+#####################################################################
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import time
+
+import MongoDB.session as ses
+import PostgreSQL.connect_db as connect
+import fill_database_table as fill
+import create_database_table as tables
+import content_rule
+import recommendation_engine
+import instrumentation as inst
+import benchmark.generate_data as generate
+
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(__file__), "results")
+
+postgres_settings = {'host': 'localhost', 'database': 'opisop_benchmark', 'user': 'postgres', 'password': 'postgres'}
+mongo_settings = {'host': 'Localhost', 'port': 27017, 'database_name': 'opisop_benchmark'}
+
+# Tables in the order they are filled, a table comes after the tables it depends on
+FILL_ORDER = ['product', 'profiles', 'sessions', 'ordered', 'history']
+
+def percentile(values, percent):
+    """Get a percentile using the nearest rank
+
+    @params
+    values: sorted list of numbers
+    percent: percentile between 0 and 100
+
+    return: the value at the percentile, None for no values
+    """
+    if not values:
+        return None
+    rank = max(1, math.ceil(percent / 100 * len(values)))
+    return values[rank - 1]
+
+def get_latencies(durations):
+    """Summarize request durations
+
+    @params
+    durations: list of durations in seconds
+
+    return: dict with the amount of requests and the mean, p50, p95, p99 and max in milliseconds
+    """
+    durations = sorted(round(duration * 1000, 3) for duration in durations)
+    return {
+        "requests": len(durations),
+        "mean_ms": round(sum(durations) / len(durations), 3) if durations else None,
+        "p50_ms": percentile(durations, 50),
+        "p95_ms": percentile(durations, 95),
+        "p99_ms": percentile(durations, 99),
+        "max_ms": durations[-1] if durations else None,
+    }
+
+def time_stage(results, name, function, *args, **kwargs):
+    """Run a function and save its duration in results
+
+    @params
+    results: dict the duration in seconds is saved in, under name
+    name: name of the stage
+    function: the function that is measured
+
+    return: return value of function
+    """
+    print(f"running {name}")
+    start = time.perf_counter()
+    value = function(*args, **kwargs)
+    results[name] = round(time.perf_counter() - start, 3)
+    return value
+
+def reset_tables(cursor):
+    """Drop and create all tables of create_database_table.py
+
+    @params
+    cursor: PostgreSQL cursor of the benchmark database
+    """
+    for statement in tables.sql_statements:
+        table_name = statement.split()[2]
+        cursor.execute(f'DROP TABLE IF EXISTS {table_name} CASCADE')
+        cursor.execute(statement)
+
+def run_etl(mongo_database, connection):
+    """Fill all tables from the benchmark MongoDB database, one table at a time
+
+    The tables are filled one after another, so each duration is the duration of that table alone.
+
+    @params
+    mongo_database: the benchmark MongoDB database
+    connection: PostgreSQL connection to the benchmark database
+
+    return: dict with the duration in seconds per stage
+    """
+    stages = {}
+    cursor = connection.cursor()
+    reset_tables(cursor)
+    connection.commit()
+    for table_name in FILL_ORDER:
+        loader = fill.TABLE_LOADERS[table_name][0]
+        time_stage(stages, loader.__name__, loader, mongo_database, cursor)
+        connection.commit()
+    time_stage(stages, "set_constraints", fill.set_constraints, cursor)
+    time_stage(stages, "build_indexes", tables.build_indexes, cursor)
+    content_group_data, content_rule_data = time_stage(stages, "generate_content_rule_data", content_rule.generate_content_rule_data, cursor)
+    time_stage(stages, "insert_content_rule_data", content_rule.insert_content_rule_data, cursor, content_group_data, content_rule_data)
+    cursor.execute('ANALYZE content_group')
+    cursor.execute('ANALYZE content_rule')
+    cursor.close()
+    connection.commit()
+    return stages
+
+def get_sample(cursor, table, column, amount, rng):
+    """Get random values of a column to request recommendations for
+
+    @params
+    cursor: PostgreSQL cursor
+    table: name of the table, or tables joined together
+    column: name of the column
+    amount: amount of values
+    rng: random.Random used for the sample
+
+    return: list of amount values, values can occur more than once
+    """
+    cursor.execute(f'SELECT DISTINCT {column} FROM {table} WHERE {column} IS NOT NULL')
+    values = [x[0] for x in cursor.fetchall()]
+    if not values:
+        return []
+    return [rng.choice(values) for _ in range(amount)]
+
+def measure_requests(function, arguments):
+    """Measure the duration of one call per argument tuple
+
+    @params
+    function: the function that is measured
+    arguments: list of argument tuples
+
+    return: list of durations in seconds
+    """
+    durations = []
+    for argument in arguments:
+        start = time.perf_counter()
+        function(*argument)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+def run_latency(connection, requests, amount, comparative_users, seed=0):
+    """Measure the latency of content and profile recommendations
+
+    The service is created without cache, so every request goes to PostgreSQL.
+
+    @params
+    connection: PostgreSQL connection to the benchmark database
+    requests: amount of requests per recommendation type
+    amount: amount of recommendations per request
+    comparative_users: amount of comparative users for profile recommendations
+    seed: seed for the requested ids (DEFAULT=0)
+
+    return: dict with the latencies per recommendation type, see get_latencies()
+    """
+    rng = random.Random(seed)
+    cursor = connection.cursor()
+    product_ids = get_sample(cursor, "content_rule JOIN product_keys USING (product_id)", "source_id", requests, rng)
+    profile_ids = get_sample(cursor, "sessions JOIN profile_keys USING (profile_id)", "source_id", requests, rng)
+    cursor.close()
+    service = recommendation_engine.RecommendationService(**postgres_settings, cache_size=0)
+    try:
+        # one request of each type first, so setting up the pool and preparing statements is not measured
+        if product_ids:
+            service.get_content_recommendations(product_ids[0], amount)
+        if profile_ids:
+            service.get_profile_recommendations(profile_ids[0], comparative_users, amount)
+        print(f"measuring {requests} requests per recommendation type")
+        content = measure_requests(service.get_content_recommendations, [(product_id, amount) for product_id in product_ids])
+        profile = measure_requests(service.get_profile_recommendations, [(profile_id, comparative_users, amount) for profile_id in profile_ids])
+    finally:
+        service.close()
+    return {
+        "get_content_recommendations": get_latencies(content),
+        "get_profile_recommendations": get_latencies(profile),
+    }
+
+def get_commit():
+    """Get the current git commit, to tell results apart
+
+    return: commit hash, None outside a git repository
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def save_results(results, directory=RESULTS_DIRECTORY):
+    """Save results as JSON
+
+    @params
+    results: dict of results
+    directory: directory the file is saved in (DEFAULT=RESULTS_DIRECTORY)
+
+    return: path of the saved file
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{results["scale"]}.json')
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=2)
+    return path
+
+def compare_results(previous, current):
+    """Print the change of every stage duration and latency compared to an earlier run
+
+    @params
+    previous: dict of earlier results
+    current: dict of new results
+    """
+    rows = []
+    for name, seconds in current["stages"].items():
+        rows.append((name, previous["stages"].get(name), seconds, 's'))
+    for name, latencies in current["latency"].items():
+        for key in ["p50_ms", "p95_ms", "p99_ms"]:
+            rows.append((f'{name} {key}', previous["latency"].get(name, {}).get(key), latencies[key], 'ms'))
+    print(f'compared to {previous.get("commit")} ({previous.get("scale")}):')
+    for name, before, after, unit in rows:
+        if before in (None, 0) or after is None:
+            print(f'  {name}: {after}{unit}')
+        else:
+            print(f'  {name}: {before}{unit} -> {after}{unit} ({(after - before) / before * 100:+.1f}%)')
+
+def run(scale, seed=0, requests=1000, amount=5, comparative_users=10, generate_data=True, compare=None):
+    """Generate the data, fill the tables, measure the recommendations and save the results
+
+    @params
+    scale: key of generate.SCALES
+    seed: seed of the generated data and requested ids (DEFAULT=0)
+    requests: amount of requests per recommendation type (DEFAULT=1000)
+    amount: amount of recommendations per request (DEFAULT=5)
+    comparative_users: amount of comparative users for profile recommendations (DEFAULT=10)
+    generate_data: generate the MongoDB data again, False reuses the data of an earlier run (DEFAULT=True)
+    compare: OPTIONAL path of earlier results to compare with
+
+    return: dict of results
+    """
+    mongo_client = ses.get_client(host=mongo_settings['host'], port=mongo_settings['port'])
+    mongo_database = ses.get_database(client=mongo_client, database_name=mongo_settings['database_name'])
+    connection = connect.connect_db(**postgres_settings)
+    inst.configure(output=False)
+    try:
+        results = {"scale": scale, "seed": seed, "commit": get_commit(), "python": platform.python_version()}
+        if generate_data:
+            results["documents"] = generate.generate_database(mongo_database, generate.SCALES[scale], seed)
+        else:
+            results["documents"] = generate.get_sizes(generate.SCALES[scale])
+        results["stages"] = run_etl(mongo_database, connection)
+        results["latency"] = run_latency(connection, requests, amount, comparative_users, seed)
+        results["metrics"] = inst.metrics.summary()
+    finally:
+        connection.close()
+        mongo_client.close()
+    print(json.dumps({"stages": results["stages"], "latency": results["latency"]}, indent=2))
+    print(f"saved results to {save_results(results)}")
+    if compare != None:
+        with open(compare) as file:
+            compare_results(json.load(file), results)
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the ETL and the recommendations on synthetic data")
+    parser.add_argument('--scale', choices=list(generate.SCALES), default="10k", help="amount of sessions to generate")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the generated data")
+    parser.add_argument('--requests', type=int, default=1000, help="amount of requests per recommendation type")
+    parser.add_argument('--amount', type=int, default=5, help="amount of recommendations per request")
+    parser.add_argument('--comparative-users', type=int, default=10, help="amount of comparative users for profile recommendations")
+    parser.add_argument('--skip-generate', action='store_true', help="reuse the MongoDB data of an earlier run")
+    parser.add_argument('--compare', help="path of earlier results to compare with")
+    arguments = parser.parse_args()
+    run(arguments.scale, arguments.seed, arguments.requests, arguments.amount, arguments.comparative_users, not arguments.skip_generate, arguments.compare)
@@ -0,0 +1,124 @@
+###############################################################
+#                                                             #
+#   Use this file to pre-load the co_purchase table           #
+#                                                             #
+#   For each pair of products, product_pair_count holds in    #
+#   how many sessions both were ordered. co_purchase holds    #
+#   the products most often bought together with a product.   #
+#                                                             #
+###############################################################
+
+import PostgreSQL.connect_db as connect
+import recommendation_cache as cache
+import instrumentation as inst
+
+# Amount of bought together products saved per product
+CO_PURCHASE_TOP_N = 20
+
+# Amount of sessions counted per statement when building the table from scratch
+SESSION_BATCH_SIZE = 10000
+
+def add_sessions(cursor, session_ids):
+    """Count the product pairs ordered together in the given sessions
+
+    Sessions that have been counted before are skipped (see co_purchase_session),
+    so calling this again for the same sessions does not count them twice.
+    A product ordered more than once in a session counts once.
+
+    @params
+    cursor: PostgreSQL cursor
+    session_ids: list of session keys (see surrogate_keys.py) of which the orders are in the ordered table
+
+    return: set of product keys of which the counts changed
+    """
+    cursor.execute(
+    '''WITH new_sessions AS (
+            INSERT INTO co_purchase_session (session_id)
+            SELECT unnest(%s::int[])
+            ON CONFLICT DO NOTHING
+            RETURNING session_id
+        ), items AS (
+            SELECT DISTINCT o.session_id, o.product_id
+            FROM ordered AS o, new_sessions AS n
+            WHERE o.session_id=n.session_id
+        )
+        INSERT INTO product_pair_count (product_id, other_product_id, count)
+        SELECT a.product_id, b.product_id, COUNT(*)
+        FROM items AS a, items AS b
+        WHERE a.session_id=b.session_id AND a.product_id<>b.product_id
+        GROUP BY a.product_id, b.product_id
+        ON CONFLICT (product_id, other_product_id) DO UPDATE SET count = product_pair_count.count + EXCLUDED.count
+        RETURNING product_id''',
+        [list(session_ids)]
+    )
+    return {x[0] for x in cursor.fetchall()}
+
+def refresh_neighbours(cursor, product_ids, top_n=CO_PURCHASE_TOP_N):
+    """Save the top_n products most often bought together with each of the given products
+
+    @params
+    cursor: PostgreSQL cursor
+    product_ids: list of product keys of which the counts changed, see add_sessions()
+    top_n: amount of products saved per product (DEFAULT=CO_PURCHASE_TOP_N)
+    """
+    cursor.execute(
+    '''INSERT INTO co_purchase (product_id, recommended_product_ids)
+        SELECT product_id, (array_agg(other_product_id ORDER BY count DESC, other_product_id))[1:%s]
+        FROM product_pair_count
+        WHERE product_id = ANY(%s::int[])
+        GROUP BY product_id
+        ON CONFLICT (product_id) DO UPDATE SET recommended_product_ids = EXCLUDED.recommended_product_ids''',
+        [top_n, list(product_ids)]
+    )
+
+def update_co_purchase(cursor, session_ids, top_n=CO_PURCHASE_TOP_N):
+    """Add new sessions to the co_purchase data
+
+    @params
+    cursor: PostgreSQL cursor
+    session_ids: list of session keys (see surrogate_keys.py) of which the orders are in the ordered table
+    top_n: amount of products saved per product (DEFAULT=CO_PURCHASE_TOP_N)
+    """
+    product_ids = add_sessions(cursor, session_ids)
+    if product_ids:
+        refresh_neighbours(cursor, product_ids, top_n)
+
+def build_co_purchase(cursor, top_n=CO_PURCHASE_TOP_N, session_batch_size=SESSION_BATCH_SIZE):
+    """Count all sessions in the ordered table that have not been counted yet
+
+    The neighbours are refreshed once at the end, instead of after every batch of sessions.
+
+    @params
+    cursor: PostgreSQL cursor
+    top_n: amount of products saved per product (DEFAULT=CO_PURCHASE_TOP_N)
+    session_batch_size: amount of sessions counted per statement (DEFAULT=SESSION_BATCH_SIZE)
+    """
+    cursor.execute(
+    '''SELECT DISTINCT o.session_id
+        FROM ordered AS o
+        WHERE NOT EXISTS (SELECT 1 FROM co_purchase_session AS c WHERE c.session_id=o.session_id)'''
+    )
+    session_ids = [x[0] for x in cursor.fetchall()]
+    product_ids = set()
+    with inst.metrics.stage("count co_purchase sessions") as stage:
+        for i in range(0, len(session_ids), session_batch_size):
+            product_ids |= add_sessions(cursor, session_ids[i:i+session_batch_size])
+            stage.add_rows(len(session_ids[i:i+session_batch_size]))
+    print(f'counted {len(session_ids)} sessions, refreshing {len(product_ids)} products')
+    refresh_neighbours(cursor, product_ids, top_n)
+
+if __name__ == '__main__':
+    # Establish connection with PostgreSQL
+    connection = connect.connect_db(host='localhost', database='opisop_sql', user='postgres', password='postgres')
+    cursor = connection.cursor()
+
+    # count all sessions that are not counted yet and save the top products per product
+    build_co_purchase(cursor)
+    cursor.execute('ANALYZE co_purchase')
+
+    # let running recommendation services drop their cached recommendations
+    cache.bump_version(cursor, "content")
+
+    cursor.close()
+    connection.commit()
+    inst.metrics.print_summary("co_purchase")
@@ -0,0 +1,151 @@
+###################################################################
+#                                                                 #
+#   Use this file to build the profile recommendation model       #
+#                                                                 #
+#   The model holds all orders as a sparse profile x product      #
+#   matrix, so profile recommendations can be served from memory  #
+#   by the RecommendationService in recommendation_engine.py.     #
+#                                                                 #
+###################################################################
+
+import numpy as np
+from scipy import sparse
+
+import PostgreSQL.connect_db as connect
+
+class ProfileModel:
+    """Sparse profile x product matrix of orders
+
+    matrix[profile, product] is the amount of times the profile ordered the product.
+    product_rank orders the products on stock, discount, repeat_product and fast_mover,
+    the same way get_profile_recommendations() breaks ties.
+    Products that are ordered but not in the product table have a rank of -1 and are never recommended.
+
+    @params
+    profile_ids: array of profile ids, one per row of the matrix
+    product_ids: array of product ids, one per column of the matrix
+    matrix: scipy sparse matrix of order counts
+    product_rank: int array with the tie break position of each product
+    """
+    def __init__(self, profile_ids, product_ids, matrix, product_rank):
+        self.profile_ids = np.asarray(profile_ids)
+        self.product_ids = np.asarray(product_ids)
+        self.matrix = sparse.csr_matrix(matrix)
+        self.matrix_csc = self.matrix.tocsc()
+        self.product_rank = np.asarray(product_rank)
+        self.profile_index = {profile_id: i for i, profile_id in enumerate(self.profile_ids.tolist())}
+
+    def recommend(self, profile_id, comparative_user_ammount, recommendation_amount):
+        """get recomendation for given profile
+
+        Gives the same recommendations as the querry in get_profile_recommendations():
+        the 'comparative_user_ammount' users with the most orders of products the profile ordered are selected,
+        their orders of products the profile did not order are counted,
+        and the products are ordered by that frequency, stock, discount, repeat product and fast_mover.
+        Users with an equal amount of overlap can be picked in a different order than PostgreSQL would.
+
+        @params
+        profile_id: the id of the user that needs recommendations
+        comparative_user_amounts: the amount of users the profile is compared to
+        recommendation_amount: amount of products returned at the end
+
+        return: list of product ids with the maximal length of 'recommendation_amount'
+        """
+        row = self.profile_index.get(profile_id)
+        if row is None or comparative_user_ammount <= 0 or recommendation_amount <= 0:
+            return []
+        own_products = self.matrix.indices[self.matrix.indptr[row]:self.matrix.indptr[row+1]]
+        if own_products.size == 0:
+            return []
+
+        # overlap of every other user with the products of this profile
+        overlap = self.matrix_csc[:, own_products]
+        users, inverse = np.unique(overlap.indices, return_inverse=True)
+        totals = np.bincount(inverse, weights=overlap.data)
+        totals[users == row] = 0
+        users, totals = users[totals > 0], totals[totals > 0]
+        if users.size > comparative_user_ammount:
+            users = users[np.argpartition(-totals, comparative_user_ammount-1)[:comparative_user_ammount]]
+
+        # frequency of the products ordered by the most similar users
+        orders = self.matrix[users]
+        products, inverse = np.unique(orders.indices, return_inverse=True)
+        frequency = np.bincount(inverse, weights=orders.data)
+        keep = ~np.isin(products, own_products) & (self.product_rank[products] >= 0)
+        products, frequency = products[keep], frequency[keep]
+        order = np.lexsort((self.product_rank[products], -frequency))[:recommendation_amount]
+        return self.product_ids[products[order]].tolist()
+
+def build_profile_model(cursor):
+    """Build a ProfileModel from the sessions, ordered and product tables
+
+    The keys in these tables are translated back into the profile and product ids (see surrogate_keys.py),
+    so the model is used with the same ids as the rest of the recommendation_engine.py API.
+
+    @params
+    cursor: PostgreSQL cursor
+
+    return: ProfileModel
+    """
+    cursor.execute(
+    '''SELECT pk.source_id, k.source_id, c.count
+        FROM (
+            SELECT s.profile_id, o.product_id, COUNT(*) AS count
+            FROM sessions AS s, ordered AS o
+            WHERE s.session_id=o.session_id AND s.profile_id IS NOT NULL
+            GROUP BY s.profile_id, o.product_id
+        ) AS c, profile_keys AS pk, product_keys AS k
+        WHERE pk.profile_id=c.profile_id AND k.product_id=c.product_id'''
+    )
+    orders = cursor.fetchall()
+    # PostgreSQL sorts the products, so NULLs and discount strings are ordered exactly like the querry does
+    cursor.execute('''SELECT k.source_id FROM product AS p, product_keys AS k WHERE k.product_id=p.product_id ORDER BY p.stock DESC, p.discount ASC, p.repeat_product DESC, p.fast_mover DESC''')
+    ranked_product_ids = [x[0] for x in cursor.fetchall()]
+
+    profile_index = {}
+    product_index = {product_id: i for i, product_id in enumerate(ranked_product_ids)}
+    rows = np.empty(len(orders), dtype=np.int64)
+    columns = np.empty(len(orders), dtype=np.int64)
+    counts = np.empty(len(orders), dtype=np.float64)
+    for i, (profile_id, product_id, count) in enumerate(orders):
+        rows[i] = profile_index.setdefault(profile_id, len(profile_index))
+        columns[i] = product_index.setdefault(product_id, len(product_index))
+        counts[i] = count
+    product_rank = np.full(len(product_index), -1, dtype=np.int64)
+    product_rank[:len(ranked_product_ids)] = np.arange(len(ranked_product_ids))
+    matrix = sparse.csr_matrix((counts, (rows, columns)), shape=(len(profile_index), len(product_index)))
+    return ProfileModel(list(profile_index), list(product_index), matrix, product_rank)
+
+def save_profile_model(model, path):
+    """Save a ProfileModel to a .npz file
+
+    @params
+    model: ProfileModel
+    path: path of the file
+    """
+    np.savez(path, profile_ids=model.profile_ids.astype(str), product_ids=model.product_ids.astype(str),
+             data=model.matrix.data, indices=model.matrix.indices, indptr=model.matrix.indptr,
+             shape=np.array(model.matrix.shape), product_rank=model.product_rank)
+
+def load_profile_model(path):
+    """Load a ProfileModel saved by save_profile_model()
+
+    @params
+    path: path of the file
+
+    return: ProfileModel
+    """
+    with np.load(path) as data:
+        matrix = sparse.csr_matrix((data["data"], data["indices"], data["indptr"]), shape=tuple(data["shape"]))
+        return ProfileModel(data["profile_ids"], data["product_ids"], matrix, data["product_rank"])
+
+if __name__ == '__main__':
+    # Establish connection with PostgreSQL
+    connection = connect.connect_db(host='localhost', database='opisop_sql', user='postgres', password='postgres')
+    cursor = connection.cursor()
+
+    # build the model and save it for the recommendation service
+    save_profile_model(build_profile_model(cursor), 'profile_model.npz')
+
+    cursor.close()
+    connection.close()
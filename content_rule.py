@@ -5,10 +5,45 @@
 #########################################################
 
 import PostgreSQL.connect_db as connect
-import PostgreSQL.select as sel
-import fill_database_table as fill
+import PostgreSQL.insert as ins
+import recommendation_cache as cache
+import instrumentation as inst
 
-def generate_content_rule_data(cursor, product_ids):
+# Amount of recommendations per group that is also saved as a small separate array.
+# Requests for at most this many recommendations never have to read the full group.
+TOP_N = 20
+
+def get_product_groups(cursor, groups=None):
+    """Get all groups of products sharing the same brand, category and sub_category
+
+    The groups are built by PostgreSQL in one scan over the product table.
+    Products missing one of the three fields are left out,
+    as are groups containing only one product.
+
+    @params
+    cursor: cursor corresponding to your connection to PostgreSQL
+    groups: OPTIONAL list of (brand, category, sub_category) tuples, only these groups are returned
+
+    returns: list of tuples as follows:
+    (brand, category, sub_category, [list of product_ids])
+    """
+    sql_statement = '''SELECT brand, category, sub_category, array_agg(product_id ORDER BY product_id)
+        FROM product
+        WHERE brand IS NOT NULL
+            AND category IS NOT NULL
+            AND sub_category IS NOT NULL'''
+    params = []
+    if groups != None:
+        sql_statement += '''
+            AND (brand, category, sub_category) IN (SELECT * FROM unnest(%s::varchar[], %s::varchar[], %s::varchar[]))'''
+        params = [[group[i] for group in groups] for i in range(3)]
+    sql_statement += '''
+        GROUP BY brand, category, sub_category
+        HAVING COUNT(*) > 1'''
+    cursor.execute(sql_statement, params or None)
+    return cursor.fetchall()
+
+def generate_content_rule_data(cursor, product_ids=None, top_n=TOP_N, groups=None, first_group_id=0):
     """
     generate related data based on content rule
 
@@ -21,46 +56,102 @@ def generate_content_rule_data(cursor, product_ids):
     Same for products that do not contain all three fields or just a subset,
     they will not generate a recommendations either.
 
+    Instead of saving every other product of the group for each product,
+    each group is saved once in content_group and each product only points to its group.
+    The recommendations for a product are the products of its group, without the product itself.
+    This keeps the storage linear in the amount of products.
+
     @params
     cursor: cursor corresponding to your connection to PostgreSQL
-    product_ids: list of all product ids that the content rule will be ran upon
+    product_ids: OPTIONAL list of product keys (see surrogate_keys.py), only groups containing one of these are generated, by default all groups
+    top_n: amount of recommendations precomputed in top_product_ids (DEFAULT=TOP_N)
+    groups: OPTIONAL list of (brand, category, sub_category) tuples, only these groups are generated
+    first_group_id: group_id of the first generated group, the others follow (DEFAULT=0)
 
-    returns: list of elements as follows:
-    [product_id, [list of reccomended product_ids]]
+    returns: tuple of two lists as follows:
+    [group_id, brand, category, sub_category, [list of product_ids], [list of the first top_n + 1 product_ids]]
+    [product_id, group_id]
     Where only the instances of products with actual reccomendations are saved
     """
-    product_data = []
-    for id in product_ids:
-        if id.find("'") == -1:
-            data = sel.postgresql_select(cursor, ["brand", "category", "sub_category"], "product", [f"product_id = '{id}'", "brand is not NULL", "category is not NULL", "sub_category is not NULL"])
-            if len(data) == 0:
-                product_data.append(None)
-            else:
-                product_data.append(data[0])
+    if product_ids != None:
+        product_ids = set(product_ids)
+    content_group_data = []
     content_rule_data = []
-    for data in set(product_data):
-        if data != None and data[0].find("'") == -1 and data[1].find("'") == -1 and data[2].find("'") == -1:
-            corresponding_ids = sel.postgresql_select(cursor, ["product_id"], "product", [f"brand = '{data[0]}'", f"category = '{data[1]}'", f"sub_category = '{data[2]}'"])
-            corresponding_ids = fill.filter_array(corresponding_ids, "non-array")
-            for i, id in enumerate(corresponding_ids):
-                if len(corresponding_ids) != 1:
-                    content_rule_data.append([id, corresponding_ids[:i]+corresponding_ids[i+1:]])
-    return content_rule_data
+    for group_id, (brand, category, sub_category, corresponding_ids) in enumerate(get_product_groups(cursor, groups), start=first_group_id):
+        if product_ids != None and product_ids.isdisjoint(corresponding_ids):
+            continue
+        content_group_data.append([group_id, brand, category, sub_category, corresponding_ids, corresponding_ids[:top_n+1]])
+        for id in corresponding_ids:
+            content_rule_data.append([id, group_id])
+    return content_group_data, content_rule_data
+
+def insert_content_rule_data(cursor, content_group_data, content_rule_data):
+    """Insert data generated by generate_content_rule_data() into content_group and content_rule
+
+    @params
+    cursor: cursor corresponding to your connection to PostgreSQL
+    content_group_data: list of content_group rows
+    content_rule_data: list of content_rule rows
+    """
+    ins.bulk_insert(cursor, "content_group", content_group_data, labels=["group_id", "brand", "category", "sub_category", "product_ids", "top_product_ids"])
+    ins.bulk_insert(cursor, "content_rule", content_rule_data, labels=["product_id", "group_id"])
+
+def refresh_content_groups(cursor, groups, top_n=TOP_N):
+    """Regenerate the content rule for some groups
+
+    Used after products changed, see sync_database.py.
+    The given groups are removed and generated again from the current product table,
+    so products that left or joined a group are handled as well.
+    Pass both the old and new (brand, category, sub_category) of changed products.
+
+    @params
+    cursor: cursor corresponding to your connection to PostgreSQL
+    groups: list of (brand, category, sub_category) tuples
+    top_n: amount of recommendations precomputed in top_product_ids (DEFAULT=TOP_N)
+    """
+    groups = list({tuple(group) for group in groups if None not in group})
+    if not groups:
+        return
+    params = [[group[i] for group in groups] for i in range(3)]
+    cursor.execute(
+    '''DELETE FROM content_rule WHERE group_id IN (
+            SELECT group_id FROM content_group
+            WHERE (brand, category, sub_category) IN (SELECT * FROM unnest(%s::varchar[], %s::varchar[], %s::varchar[])))''',
+        params
+    )
+    cursor.execute(
+    '''DELETE FROM content_group
+        WHERE (brand, category, sub_category) IN (SELECT * FROM unnest(%s::varchar[], %s::varchar[], %s::varchar[]))''',
+        params
+    )
+    cursor.execute('SELECT COALESCE(MAX(group_id) + 1, 0) FROM content_group')
+    first_group_id = cursor.fetchone()[0]
+    content_group_data, content_rule_data = generate_content_rule_data(cursor, top_n=top_n, groups=groups, first_group_id=first_group_id)
+    insert_content_rule_data(cursor, content_group_data, content_rule_data)
+
+if __name__ == '__main__':
+    # Establish connection with PostgreSQL
+    connection = connect.connect_db(host='localhost', database='opisop_sql', user='postgres', password='postgres')
+    cursor = connection.cursor()
+
+    # remove the previous content rule, in the same transaction so services keep reading it until the commit
+    cursor.execute('DELETE FROM content_rule')
+    cursor.execute('DELETE FROM content_group')
 
-# Establish connection with PostgreSQL
-connection = connect.connect_db(host='localhost', database='opisop_sql', user='postgres', password='postgres')
-cursor = connection.cursor()
+    # get all related products together
+    content_group_data, content_rule_data = generate_content_rule_data(cursor)
 
-# Get all product ids 
-all_product_ids = sel.postgresql_select(cursor, ["product_id"], "product")
-all_product_ids = fill.filter_array(all_product_ids, "non-array")
+    # insert content rule data into tables
+    insert_content_rule_data(cursor, content_group_data, content_rule_data)
 
-# get all related products together
-content_rule_data = generate_content_rule_data(cursor, all_product_ids)
+    # update planner statistics for the new data
+    cursor.execute('ANALYZE content_group')
+    cursor.execute('ANALYZE content_rule')
 
-# insert content rule data into table
-fill.insert_data(cursor, "content_rule", content_rule_data, labels=["product_id", "recommended_product_ids"])
+    # let running recommendation services drop their cached content recommendations
+    cache.bump_version(cursor, "content")
 
 
-cursor.close()
-connection.commit()
+    cursor.close()
+    connection.commit()
+    inst.metrics.print_summary("content_rule")
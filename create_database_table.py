@@ -43,14 +43,49 @@ def create_columns(columns):
         column_list.append(create_column_string(i[0], i[1], i[2]))
     return column_list
 
+def create_index(table, index):
+    """Create SQL statement for creating an index
 
+    @params
+    table: name of table
+    index: a list of 4 items: name, method (eg. btree), columns string and optional flags, like INCLUDE (...)
+
+    return: string of SQL statement
+    """
+    name, method, columns, optional_flags = index
+    return f'CREATE INDEX IF NOT EXISTS {name} ON {table} USING {method} ({columns}) {optional_flags} WITH (fillfactor = {INDEX_FILL_FACTOR})'
+
+def create_index_statements():
+    """Create SQL statements for all indexes in table_indexes
+
+    return: list of strings of SQL statements
+    """
+    sql_statements = []
+    for table, indexes in table_indexes.items():
+        for index in indexes:
+            sql_statements.append(create_index(table, index))
+    return sql_statements
+
+def build_indexes(cursor, maintenance_work_mem='256MB'):
+    """Build all indexes and update the planner statistics
+
+    Building indexes after the tables are filled is a lot faster than keeping them up to date during the fill,
+    so run this once the data is loaded (fill_database_table.py does so at the end).
+
+    @params
+    cursor: PostgreSQL cursor
+    maintenance_work_mem: memory PostgreSQL may use to sort while building an index (DEFAULT=256MB)
+    """
+    cursor.execute('SET maintenance_work_mem = %s', [maintenance_work_mem])
+    for statement in create_index_statements():
+        cursor.execute(statement)
+    for table in table_indexes:
+        cursor.execute(f'ANALYZE {table}')
 
-# Use the following line to connect to your PostgreSQL 
-connection = connect.connect_db(host='localhost', database='opisop_sql', user='postgres', password='postgres')
 
 # Define columns for required categories
 product_columns = [
-    ['product_id', 'VARCHAR(32)', 'PRIMARY KEY NOT NULL'],
+    ['product_id', 'INT', 'PRIMARY KEY NOT NULL'],
     ['brand', 'VARCHAR(64)', ''],
     ['category', 'VARCHAR(64)', ''],
     ['sub_category', 'VARCHAR(32)', ''],
@@ -60,34 +95,112 @@ product_columns = [
     ['discount', 'varchar(64)', ''],
 ]
 sessions_columns = [
-    ['session_id', 'VARCHAR(128)', 'PRIMARY KEY NOT NULL'],
-    ['profile_id', 'VARCHAR(32)', ''],
+    ['session_id', 'INT', 'PRIMARY KEY NOT NULL'],
+    ['profile_id', 'INT', ''],
 ]
 ordered_columns = [
-    ['session_id', 'VARCHAR(128)', 'NOT NULL'],
-    ['product_id', 'VARCHAR(32)', 'NOT NULL'], 
+    ['session_id', 'INT', 'NOT NULL'],
+    ['product_id', 'INT', 'NOT NULL'], 
 ]
 history_columns = [
-    ['profile_id', 'VARCHAR(32)', 'NOT NULL'],
-    ['product_id', 'VARCHAR(32)', 'NOT NULL'],
+    ['profile_id', 'INT', 'NOT NULL'],
+    ['product_id', 'INT', 'NOT NULL'],
     ['history_type','VARCHAR(128)','NOT NULL'], # can be either "viewed before" or "previously reccomended"
 ]
+content_group_columns = [
+    ['group_id', 'INT', 'PRIMARY KEY NOT NULL'],
+    ['brand', 'VARCHAR(64)', ''],
+    ['category', 'VARCHAR(64)', ''],
+    ['sub_category', 'VARCHAR(32)', ''],
+    ['product_ids', 'INT[]', 'NOT NULL'],
+    ['top_product_ids', 'INT[]', ''], # the first (top n + 1) product_ids, see content_rule.py
+]
 content_rule_columns = [
-    ['product_id', 'VARCHAR(32)', 'NOT NULL'],
-    ['recommended_product_ids', 'VARCHAR(32)[]', ''],
+    ['product_id', 'INT', 'PRIMARY KEY NOT NULL'],
+    ['group_id', 'INT', 'NOT NULL'],
 ]
 profiles_columns = [
-    ['profile_id', 'VARCHAR(32)', ''],
+    ['profile_id', 'INT', ''],
     ['BUID', 'VARCHAR(128)', 'PRIMARY KEY NOT NULL'],
 ]
+product_pair_count_columns = [
+    ['product_id', 'INT', 'NOT NULL'],
+    ['other_product_id', 'INT', 'NOT NULL'],
+    ['count', 'INT', 'NOT NULL'], # amount of sessions in which both products were ordered
+]
+co_purchase_columns = [
+    ['product_id', 'INT', 'PRIMARY KEY NOT NULL'],
+    ['recommended_product_ids', 'INT[]', ''], # most bought together first, see co_purchase.py
+]
+co_purchase_session_columns = [
+    ['session_id', 'INT', 'PRIMARY KEY NOT NULL'], # sessions already counted in product_pair_count
+]
+# Every product, session and profile id from MongoDB gets an INT key, the other tables store that key (see surrogate_keys.py)
+product_keys_columns = [
+    ['product_id', 'SERIAL', 'PRIMARY KEY NOT NULL'],
+    ['source_id', 'VARCHAR(32)', 'UNIQUE NOT NULL'],
+]
+session_keys_columns = [
+    ['session_id', 'SERIAL', 'PRIMARY KEY NOT NULL'],
+    ['source_id', 'VARCHAR(128)', 'UNIQUE NOT NULL'],
+]
+profile_keys_columns = [
+    ['profile_id', 'SERIAL', 'PRIMARY KEY NOT NULL'],
+    ['source_id', 'VARCHAR(32)', 'UNIQUE NOT NULL'],
+]
+recommendation_version_columns = [
+    ['name', 'VARCHAR(32)', 'PRIMARY KEY NOT NULL'], # can be either "content" or "profile", see recommendation_cache.py
+    ['version', 'BIGINT', 'NOT NULL'],
+]
+sync_state_columns = [
+    ['collection', 'VARCHAR(64)', 'PRIMARY KEY NOT NULL'],
+    ['watermark', 'TEXT', 'NOT NULL'], # extended JSON of the last synced value, see sync_database.py
+]
+
+# Define indexes for the columns our querries filter on, these are built after filling (see build_indexes())
+# sync_database.py upserts and re-inserts rows in all of these tables, so the index pages keep
+# some free space for new entries instead of splitting on every sync
+INDEX_FILL_FACTOR = 90
+product_indexes = [
+    ['product_group_index', 'btree', 'brand, category, sub_category', 'INCLUDE (product_id)'],
+]
+sessions_indexes = [
+    ['sessions_profile_id_index', 'btree', 'profile_id', 'INCLUDE (session_id)'],
+]
+ordered_indexes = [
+    ['ordered_session_id_index', 'btree', 'session_id, product_id', ''],
+    ['ordered_product_id_index', 'btree', 'product_id, session_id', ''],
+]
+history_indexes = [
+    ['history_profile_id_index', 'btree', 'profile_id', 'INCLUDE (product_id, history_type)'],
+]
+profiles_indexes = [
+    ['profiles_profile_id_index', 'btree', 'profile_id', ''],
+]
+table_indexes = {
+    'product': product_indexes,
+    'sessions': sessions_indexes,
+    'ordered': ordered_indexes,
+    'history': history_indexes,
+    'profiles': profiles_indexes,
+}
 
 # convert columns to strings
 product_column_strings = create_columns(product_columns)
 sessions_column_strings = create_columns(sessions_columns)
 ordered_column_strings = create_columns(ordered_columns)
 history_column_strings = create_columns(history_columns)
+content_group_column_strings = create_columns(content_group_columns)
 content_rule_column_strings = create_columns(content_rule_columns)
 profiles_column_strings= create_columns(profiles_columns)
+product_pair_count_column_strings = create_columns(product_pair_count_columns) + ['PRIMARY KEY (product_id, other_product_id)']
+co_purchase_column_strings = create_columns(co_purchase_columns)
+co_purchase_session_column_strings = create_columns(co_purchase_session_columns)
+product_keys_column_strings = create_columns(product_keys_columns)
+session_keys_column_strings = create_columns(session_keys_columns)
+profile_keys_column_strings = create_columns(profile_keys_columns)
+recommendation_version_column_strings = create_columns(recommendation_version_columns)
+sync_state_column_strings = create_columns(sync_state_columns)
 
 # create and collect sql statements
 sql_statements = []
@@ -95,14 +208,27 @@ sql_statements.append(create_table(name='product', column_strings=product_column
 sql_statements.append(create_table(name='sessions', column_strings=sessions_column_strings))
 sql_statements.append(create_table(name='ordered', column_strings=ordered_column_strings))
 sql_statements.append(create_table(name='history', column_strings=history_column_strings))
+sql_statements.append(create_table(name='content_group', column_strings=content_group_column_strings))
 sql_statements.append(create_table(name='content_rule', column_strings=content_rule_column_strings))
 sql_statements.append(create_table(name='profiles', column_strings=profiles_column_strings))
-
-cursor = connection.cursor()
-for statement in sql_statements:
-    cursor.execute(statement)
-cursor.close()
-connection.commit()
+sql_statements.append(create_table(name='product_pair_count', column_strings=product_pair_count_column_strings))
+sql_statements.append(create_table(name='co_purchase', column_strings=co_purchase_column_strings))
+sql_statements.append(create_table(name='co_purchase_session', column_strings=co_purchase_session_column_strings))
+sql_statements.append(create_table(name='product_keys', column_strings=product_keys_column_strings))
+sql_statements.append(create_table(name='session_keys', column_strings=session_keys_column_strings))
+sql_statements.append(create_table(name='profile_keys', column_strings=profile_keys_column_strings))
+sql_statements.append(create_table(name='recommendation_version', column_strings=recommendation_version_column_strings))
+sql_statements.append(create_table(name='sync_state', column_strings=sync_state_column_strings))
+
+if __name__ == '__main__':
+    # Use the following line to connect to your PostgreSQL 
+    connection = connect.connect_db(host='localhost', database='opisop_sql', user='postgres', password='postgres')
+
+    cursor = connection.cursor()
+    for statement in sql_statements:
+        cursor.execute(statement)
+    cursor.close()
+    connection.commit()
 
 
 #TODO: foreighn key constraingts
\ No newline at end of file
@@ -0,0 +1,176 @@
+###################################################################
+#                                                                 #
+#   Use this file to build the per-profile exclusion filter       #
+#                                                                 #
+#   The filter holds, for every profile, the products in its      #
+#   history (previously recommended or viewed before), so the     #
+#   RecommendationService in recommendation_engine.py can leave   #
+#   them out without querying the history table per request.      #
+#                                                                 #
+###################################################################
+
+import numpy as np
+
+import PostgreSQL.connect_db as connect
+
+# Extra recommendations fetched when a profile has excluded products, the same for every profile,
+# so the cached and coalesced recommendations of a product are shared by all profiles
+EXCLUSION_MARGIN = 10
+
+class ExcludedProducts:
+    """The excluded products of one profile, see ExclusionFilter.excluded()
+
+    Supports len() and in, a product id is looked up with a binary search
+    over the sorted keys of the profile instead of building a set per request.
+
+    @params
+    product_keys: sorted int array of the excluded product keys
+    product_index: dict of {product_id: key}
+    """
+    def __init__(self, product_keys, product_index):
+        self.product_keys = product_keys
+        self.product_index = product_index
+
+    def __len__(self):
+        return len(self.product_keys)
+
+    def __contains__(self, product_id):
+        key = self.product_index.get(product_id)
+        if key is None:
+            return False
+        position = np.searchsorted(self.product_keys, key)
+        return position < len(self.product_keys) and self.product_keys[position] == key
+
+class ExclusionFilter:
+    """Products to leave out of the recommendations, per profile
+
+    The product keys of all profiles are kept in one sorted int array,
+    the keys of profile i are product_keys[offsets[i]:offsets[i+1]].
+
+    @params
+    profile_ids: array of profile ids
+    offsets: int array of len(profile_ids) + 1 positions in product_keys
+    product_keys: int array of product keys, sorted per profile (see surrogate_keys.py)
+    product_ids: array of product ids, product_ids[key] is the id of the product with that key
+    """
+    def __init__(self, profile_ids, offsets, product_keys, product_ids):
+        self.profile_ids = np.asarray(profile_ids)
+        self.offsets = np.asarray(offsets)
+        self.product_keys = np.asarray(product_keys)
+        self.product_ids = np.asarray(product_ids)
+        self.profile_index = {profile_id: i for i, profile_id in enumerate(self.profile_ids.tolist())}
+        self.product_index = {product_id: key for key, product_id in enumerate(self.product_ids.tolist()) if product_id}
+
+    def excluded(self, profile_id):
+        """Get the products a profile should not be recommended
+
+        @params
+        profile_id: the id of the user, None gives no products
+
+        return: ExcludedProducts, or an empty set for unknown profiles
+        """
+        row = self.profile_index.get(profile_id)
+        if row is None:
+            return set()
+        return ExcludedProducts(self.product_keys[self.offsets[row]:self.offsets[row+1]], self.product_index)
+
+def exclude(recommended_product_ids, excluded, amount):
+    """Leave the excluded products out of a list of recommendations
+
+    @params
+    recommended_product_ids: list of product ids, best first
+    excluded: product ids supporting len() and in, see ExclusionFilter.excluded()
+    amount: the maximum amount of recommendations returned
+
+    return: list of at most amount product ids
+    """
+    if not excluded:
+        return recommended_product_ids[:amount]
+    return [product_id for product_id in recommended_product_ids if product_id not in excluded][:amount]
+
+def get_fetch_amount(amount, excluded):
+    """Get the amount of recommendations to fetch for a request
+
+    @params
+    amount: the maximum amount of recommendations returned
+    excluded: products left out, see ExclusionFilter.excluded()
+
+    return: amount, plus EXCLUSION_MARGIN when products are left out
+    """
+    return amount + EXCLUSION_MARGIN if excluded else amount
+
+def needs_more(recommended_product_ids, recommendations, fetch_amount, amount, excluded):
+    """Check if too few recommendations were left after leaving out the excluded products
+
+    Only then the worst case, amount + len(excluded), has to be fetched.
+
+    @params
+    recommended_product_ids: list of fetched product ids
+    recommendations: the product ids left by exclude()
+    fetch_amount: amount of recommendations that was fetched
+    amount: the maximum amount of recommendations returned
+    excluded: products left out, see ExclusionFilter.excluded()
+
+    return: True if fetching amount + len(excluded) recommendations can give more
+    """
+    return len(recommendations) < amount and len(recommended_product_ids) >= fetch_amount and amount + len(excluded) > fetch_amount
+
+def build_exclusion_filter(cursor):
+    """Build an ExclusionFilter from the history table
+
+    @params
+    cursor: PostgreSQL cursor
+
+    return: ExclusionFilter
+    """
+    cursor.execute('SELECT product_id, source_id FROM product_keys')
+    product_keys = cursor.fetchall()
+    product_ids = np.full(max((key for key, _ in product_keys), default=-1) + 1, '', dtype=object)
+    for key, product_id in product_keys:
+        product_ids[key] = product_id
+    cursor.execute(
+    '''SELECT pk.source_id, array_agg(DISTINCT h.product_id ORDER BY h.product_id)
+        FROM history AS h, profile_keys AS pk
+        WHERE pk.profile_id=h.profile_id
+        GROUP BY pk.source_id'''
+    )
+    profile_ids = []
+    offsets = [0]
+    keys = []
+    for profile_id, excluded_keys in cursor.fetchall():
+        profile_ids.append(profile_id)
+        keys.extend(excluded_keys)
+        offsets.append(len(keys))
+    return ExclusionFilter(profile_ids, np.array(offsets, dtype=np.int64), np.array(keys, dtype=np.int32), product_ids.astype(str))
+
+def save_exclusion_filter(exclusion_filter, path):
+    """Save an ExclusionFilter to a .npz file
+
+    @params
+    exclusion_filter: ExclusionFilter
+    path: path of the file
+    """
+    np.savez(path, profile_ids=exclusion_filter.profile_ids.astype(str), offsets=exclusion_filter.offsets,
+             product_keys=exclusion_filter.product_keys, product_ids=exclusion_filter.product_ids.astype(str))
+
+def load_exclusion_filter(path):
+    """Load an ExclusionFilter saved by save_exclusion_filter()
+
+    @params
+    path: path of the file
+
+    return: ExclusionFilter
+    """
+    with np.load(path) as data:
+        return ExclusionFilter(data["profile_ids"], data["offsets"], data["product_keys"], data["product_ids"])
+
+if __name__ == '__main__':
+    # Establish connection with PostgreSQL
+    connection = connect.connect_db(host='localhost', database='opisop_sql', user='postgres', password='postgres')
+    cursor = connection.cursor()
+
+    # build the filter and save it for the recommendation service
+    save_exclusion_filter(build_exclusion_filter(cursor), 'exclusion_filter.npz')
+
+    cursor.close()
+    connection.close()
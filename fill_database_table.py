@@ -2,15 +2,78 @@
 #                                                              #
 #       Use this file to fill up a given database table        #
 #                                                              #
-#    NOTE: This file contains a lot of progress bar prints.    #
-#       Feel free to remove for a tiny performance boost.      #
+#    NOTE: Progress is printed at most once per second.        #
+#      Use instrumentation.configure(output=False) to hide     #
+#      it, or enabled=False to turn off all measurements.      #
 #                                                              #
 ################################################################
 
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
 import MongoDB.session as ses
 import MongoDB.read_collection as read
 import PostgreSQL.connect_db as connect
 import PostgreSQL.select as sel
+import PostgreSQL.insert as ins
+import recommendation_cache as cache
+import instrumentation as inst
+import create_database_table as tables
+import surrogate_keys as keys
+
+# Amount of processes reading the sessions and visitors collections per table, see read.iter_collection_information_parallel()
+# Tables are filled in parallel as well, so by default each table gets half of the CPUs. 1 reads with one cursor.
+# Profiles are always read with one cursor, the latest profile of a BUID wins so the order matters.
+SCAN_WORKERS = max(1, (os.cpu_count() or 1) // 2)
+
+# Conversion for each type a filter can convert to, see filter_data()
+CONVERTERS = {
+    "string": str,
+    "int": int,
+    "non-array": lambda value: value[0],
+    "date": lambda value: str(value).split(' ',1)[0],
+}
+
+def chain_converters(first, second):
+    """Combine two conversions of the same column into one, None values are not converted
+
+    @params
+    first: conversion applied first
+    second: conversion applied to the result of first
+
+    return: combined conversion
+    """
+    def convert(value):
+        value = first(value)
+        return None if value is None else second(value)
+    return convert
+
+def compile_conversions(filters):
+    """Compile type filters into one conversion of whole batches
+
+    All [index, type] filters are combined into one plan with a single conversion per column,
+    so each batch is converted in one pass, instead of one pass per filter.
+
+    @params
+    filters: list of [index, type] filters, see filter_data() for the types
+
+    return: function converting a batch of datapoints in place and returning it
+    """
+    plan = {}
+    for index, new_type in filters:
+        converter = CONVERTERS.get(new_type)
+        if converter == None:
+            continue
+        plan[index] = chain_converters(plan[index], converter) if index in plan else converter
+    plan = list(plan.items())
+    def convert_batch(data):
+        for datapoint in data:
+            for index, converter in plan:
+                value = datapoint[index]
+                if value is not None:
+                    datapoint[index] = converter(value)
+        return data
+    return convert_batch
 
 def filter_data(data, index, new_type):
     """Filter a nested array
@@ -18,6 +81,7 @@ def filter_data(data, index, new_type):
     Due to, lets say, interesting datatypes in our MongoDB databse,
     we require quite a bit of type filtering to insert the correct types into PostgreSQL.
     To do so, this funciton can change the type of a variable on a given index for each datapoint.
+    To convert multiple columns, compile_conversions() does so in one pass.
 
     @params
     data: the data that requires filtering. Data must consist of itterable datapoins.
@@ -26,17 +90,7 @@ def filter_data(data, index, new_type):
 
     return: filtered datapoints
     """ 
-    for datapoint in data:
-        if datapoint[index] != None:
-            if new_type == "string":
-                datapoint[index] = str(datapoint[index])
-            elif new_type == "int":
-                datapoint[index] = int(datapoint[index])
-            elif new_type == "non-array":
-                datapoint[index] = datapoint[index][0]
-            elif new_type == "date":
-                datapoint[index] = str(datapoint[index]).split(' ',1)[0]
-    return data
+    return compile_conversions([[index, new_type]])(data)
 
 def filter_array(array, new_type):
     """Filter a non-nested array
@@ -49,32 +103,27 @@ def filter_array(array, new_type):
 
     return: filtered datapoints
     """ 
-    filtered_array = []
-    for item in array:
-        if new_type == "string":
-            filtered_array.append(str(item))
-        elif new_type == "int":
-            filtered_array.append(int(item))
-        elif new_type == "non-array":
-            filtered_array.append(item[0])
-        elif new_type == "date":
-            filtered_array.append(str(item).split(' ',1)[0])
-    return filtered_array
-
-def insert_data(cursor, table, data, labels):
+    converter = CONVERTERS.get(new_type)
+    if converter == None:
+        return []
+    return [converter(item) for item in array]
+
+def insert_data(cursor, table, data, labels, batch_size=ins.BATCH_SIZE):
     """Insert array of datapoints into table of given cursor
     
+    The datapoints are written in batches by PostgreSQL.insert.bulk_insert(),
+    instead of one INSERT per datapoint.
+
     @params
     cursor: cursor corresponding to required connection
     table: name of table to insert into
     data: list of datapoints that are to be inserted
     labels: list of strings of database labels
+    batch_size: amount of datapoints written per statement (DEFAULT=ins.BATCH_SIZE)
+
+    return: amount of inserted rows
     """
-    number_of_datapoints = len(data)
-    for i, datapoint in enumerate(data):
-        percentage = round(i/(number_of_datapoints-1)*100, 2)
-        print('Progress: [{}{}{}]  {}%'.format( ('=' * int(percentage//10) ), ('>' if percentage < 100 else ''), ('.' * int(10-(((percentage)//10))-1)), percentage ), end='\r')
-        insert_item(cursor, table, labels, datapoint)
+    return ins.bulk_insert(cursor, table, data, labels, batch_size=batch_size)
 
 def insert_item(cursor, table, labels, datapoint):
     """insert one datapoint into table of given cursor
@@ -95,16 +144,12 @@ def filter_orders(data):
     Only sessions with orders will appear in this data
 
     @params
-    data: sessions data
+    data: sessions data, usually one batch of it
 
     return: filtered orders
     """
-    print("filtering orders")
     filtered_data = []
-    number_of_datapoints = len(data)
-    for i, item in enumerate(data):
-        percentage = round(i/(number_of_datapoints-1)*100, 2)
-        print('Progress: [{}{}{}]  {}%'.format( ('=' * int(percentage//10) ), ('>' if percentage < 100 else ''), ('.' * int(10-(((percentage)//10))-1)), percentage ), end='\r')
+    for item in data:
         try:
             if item[1]:
                 for products in item[2]:
@@ -163,37 +208,121 @@ def filter_profiles(data):
                 filtered_data[buid] = datapoint[0]
     return list(filtered_data.items())
 
-def link_sessions_to_profile(cursor, data):
+def get_profile_map(cursor):
+    """Get all profiles as a hash map
+
+    The profiles table is read once, so sessions can be linked without a querry per session.
+
+    @params
+    cursor: PostgreSQL cursor
+
+    return: dict of {buid: profile_id}
+    """
+    return dict(sel.postgresql_select(cursor, ["BUID", "profile_id"], "profiles"))
+
+def link_sessions_to_profile(profile_map, data):
     """Link sessions to profiles
     
     For each session a field containing a profile_id is required.
-    To get said profile_id, a querry looking for the profile_id in profiles will be carried out.
+    To get said profile_id, the BUID of the session is looked up in the profile map (see get_profile_map()).
     If no profile is found, the session will not be saved.
     If multiple profiles correspond to the same session, the first profile will count.
     When a profile is found, the datapoint will be saved and eventually returned
 
     @params
-    cursor: PostgreSQL cursor
-    data: unlinked sessions data
+    profile_map: dict of {buid: profile_id}
+    data: unlinked sessions data, usually one batch of it
 
     return: array of linked sessions data  
     """
-    print("linking sessions to profiles")
     linked_data = []
-    number_of_datapoints = len(data)
-    for i, datapoint in enumerate(data):
-        percentage = round(i/(number_of_datapoints-1)*100, 2)
-        print('Progress: [{}{}{}]  {}%'.format( ('=' * int(percentage//10) ), ('>' if percentage < 100 else ''), ('.' * int(10-(((percentage)//10))-1)), percentage ), end='\r')
+    for datapoint in data:
         if isinstance(datapoint[1], list):
             datapoint[1] = datapoint[1][0]
-        profile_id = sel.postgresql_select(cursor, ["profile_id"], "profiles", [f"buid = '{datapoint[1]}'"])
-        if len(profile_id) == 0:
+        profile_id = profile_map.get(datapoint[1])
+        if profile_id is None:
             continue
-        profile_id = filter_array(profile_id, "non-array")
-        linked_data.append([datapoint[0], profile_id[0]])
+        linked_data.append([datapoint[0], profile_id])
     return linked_data
 
-def fill_table(table_name, cursor, collection, collection_labels, table_labels, filters=None):
+def filter_references(table_name, references):
+    """Make a pipeline stage replacing ids with their keys, dropping datapoints that refer to missing ids
+
+    Ids without key do not exist in the referenced table, so these datapoints are dropped before they are written,
+    instead of deleted after loading. The amount of dropped datapoints is counted per reference in the instrumentation,
+    eg. "dropped ordered rows without product_id".
+
+    @params
+    table_name: name of the table that is filled, used in the counter names
+    references: list of (index, column, dict of {source_id: key}), see surrogate_keys.load_keys()
+
+    return: function filtering one batch, for filter_batches()
+    """
+    def filter(batch):
+        for index, column, key_map in references:
+            kept = []
+            for datapoint in batch:
+                key = key_map.get(datapoint[index])
+                if key is not None:
+                    datapoint[index] = key
+                    kept.append(datapoint)
+            if len(kept) != len(batch):
+                inst.metrics.count(f"dropped {table_name} rows without {column}", len(batch) - len(kept))
+            batch = kept
+        return batch
+    return filter
+
+def filter_batches(batches, filter):
+    """Apply one filter to a stream of batches
+
+    Each batch is filtered on its own, so only one batch is in memory per stage.
+    The exception is filter_profiles, which has to see every profile to remove BUID duplicates.
+    It only keeps the (buid, profile_id) pairs in memory and passes them on in new batches.
+
+    @params
+    batches: iterable of batches of datapoints
+    filter: string or tuple as described in fill_table(), or a function filtering one batch (eg. made by compile_conversions())
+
+    return: generator of filtered batches
+    """
+    if filter == "filter_profiles":
+        yield from ins.batched(filter_profiles(datapoint for batch in batches for datapoint in batch))
+        return
+    if not callable(filter) and not isinstance(filter, str):
+        filter = compile_conversions([filter])
+    for batch in batches:
+        if filter == "filter_orders":
+            yield filter_orders(batch)
+        elif filter == "filter_history":
+            yield filter_history(batch)
+        else:
+            yield filter(batch)
+
+def compile_filters(filters):
+    """Compile a list of filters into pipeline stages
+
+    Consecutive [index, type] filters are combined into one conversion, see compile_conversions().
+
+    @params
+    filters: list of strings, tuples or functions, as described in fill_table()
+
+    return: list of stages for filter_batches()
+    """
+    stages = []
+    conversions = []
+    for filter in filters:
+        if isinstance(filter, str) or callable(filter):
+            if conversions:
+                stages.append(compile_conversions(conversions))
+                conversions = []
+            stages.append(filter)
+        else:
+            conversions.append(filter)
+    if conversions:
+        stages.append(compile_conversions(conversions))
+    return stages
+
+def fill_table(table_name, cursor, collection, collection_labels, table_labels, filters=None, batch_size=ins.BATCH_SIZE, scan_workers=1):
     """Fill a desired table
     
     To prevent code duplication this function is a catch all for filling a table based on one MongoDB collection.
@@ -201,27 +330,26 @@ def fill_table(table_name, cursor, collection, collection_labels, table_labels,
     After which the data can be filtered, either broadly or specifically for certain tables.
     The data will then be inserted into PostgreSQL
 
+    Reading, filtering and inserting is done as a pipeline of batches,
+    so inserting starts while the collection is still being read and memory use stays flat.
+
     @params
     table_name: the name of the PostgreSQL table the data will be inserted into
     cursor: PostgreSQL cursor 
     collection: MongoDB collection
     collection_labels: List of strings, containing what data will be read from the collection
     table_labels: list of strings, corresponding to the labels in the PostgreSQL table
-    filters [OPTIONAL]: list of strings or tuples. Eg. [[1, 'string'], 'filter_orders'] 
+    filters [OPTIONAL]: list of strings, tuples or functions filtering one batch. Eg. [[1, 'string'], 'filter_orders'] 
+    batch_size [OPTIONAL]: amount of datapoints per batch and per insert statement
+    scan_workers [OPTIONAL]: amount of processes reading the collection in parallel, see read.iter_collection_information_parallel()
+        only use more than 1 when the order of the datapoints does not matter
     """
-    data = read.get_collection_information(collection, collection_labels)
+    batches = read.iter_collection_information_parallel(collection, collection_labels, batch_size=batch_size, workers=scan_workers)
     if filters != None:
-        for filter in filters:
-            if filter == "filter_orders":
-                data = filter_orders(data)
-            elif filter == "filter_history":
-                data = filter_history(data)
-            elif filter == "filter_profiles":
-                data = filter_profiles(data)
-            else:
-                data = filter_data(data, filter[0], filter[1])
-    print("writing data to PostgreSQL")
-    insert_data(cursor, table_name, data, table_labels)
+        for stage in compile_filters(filters):
+            batches = filter_batches(batches, stage)
+    print(f"writing {table_name} data to PostgreSQL")
+    insert_data(cursor, table_name, (datapoint for batch in batches for datapoint in batch), table_labels, batch_size=batch_size)
 
 def fill_product_table(mongo_database, cursor):
     """Fill empty product table
@@ -236,13 +364,14 @@ def fill_product_table(mongo_database, cursor):
     product_collection = ses.get_collection(mongo_database, "products")
     product_collection_labels = ["_id", "brand", "category", "sub_category", "herhaalaankopen", "fast_mover", ["properties", "stock"], ["properties", "discount"]]
     product_table_labels =  ['product_id', 'brand', 'category', 'sub_category', 'repeat_product', 'fast_mover', 'stock', 'discount']
-    fill_table('product', cursor, product_collection, product_collection_labels, product_table_labels, filters=[[6, "int"]])
+    fill_table('product', cursor, product_collection, product_collection_labels, product_table_labels, filters=[[6, "int"], keys.key_assigner(cursor, "product", 0)])
 
 def fill_profiles_table(mongo_database, cursor):
     """Fill empty profiles table
 
     This function will use a connection to a MongoDB to set up a connection to a visitors collection.
     The reading, filtering and writing of the data is handled by fill_table()
+    Every visitor gets a profile key, also visitors without BUIDs, so their history can refer to it.
 
     @params
     mongo_database: a connection to a MongoDB database
@@ -251,9 +380,9 @@ def fill_profiles_table(mongo_database, cursor):
     profiles_collection = ses.get_collection(mongo_database, "visitors")
     profiles_collection_labels = ["_id", "buids"]
     profiles_table_labels =  ['BUID', 'profile_id']
-    fill_table('profiles', cursor, profiles_collection, profiles_collection_labels, profiles_table_labels, filters=[[0, "string"],"filter_profiles"])
+    fill_table('profiles', cursor, profiles_collection, profiles_collection_labels, profiles_table_labels, filters=[[0, "string"], keys.key_assigner(cursor, "profile", 0), "filter_profiles"])
 
-def fill_sessions_table(mongo_database, cursor):
+def fill_sessions_table(mongo_database, cursor, batch_size=ins.BATCH_SIZE):
     """Fill empty sessions table
 
     This function will use a connection to a MongoDB to set up a connection to a sessions collection.
@@ -267,21 +396,28 @@ def fill_sessions_table(mongo_database, cursor):
     @params
     mongo_database: a connection to a MongoDB database
     cursor: PostgreSQL cursor 
+    batch_size [OPTIONAL]: amount of sessions per batch and per insert statement
     """
     sessions_collection = ses.get_collection(mongo_database, "sessions")
     sessions_collection_labels = ["_id", "buid"]
-    sessions_data = read.get_collection_information(sessions_collection, sessions_collection_labels, filters={'has_sale' : {'$eq' : True}})
-    sessions_data = filter_data(sessions_data, 0, "string")
-    sessions_data = filter_data(sessions_data, 1, "non-array")
-    sessions_data = link_sessions_to_profile(cursor, sessions_data)
     sessions_table_labels =  ['session_id', 'profile_id']
-    insert_data(cursor, "sessions", sessions_data, sessions_table_labels)
+    batches = read.iter_collection_information_parallel(sessions_collection, sessions_collection_labels, filters={'has_sale' : {'$eq' : True}}, batch_size=batch_size, workers=SCAN_WORKERS)
+    batches = filter_batches(batches, compile_conversions([[0, "string"], [1, "non-array"]]))
+    profile_map = get_profile_map(cursor)
+    batches = (link_sessions_to_profile(profile_map, batch) for batch in batches)
+    batches = filter_batches(batches, keys.key_assigner(cursor, "session", 0))
+    print("writing sessions data to PostgreSQL")
+    insert_data(cursor, "sessions", (datapoint for batch in batches for datapoint in batch), sessions_table_labels, batch_size=batch_size)
 
 def fill_ordered_table(mongo_database, cursor):
     """Fill empty ordered table
 
     This function will use a connection to a MongoDB to set up a connection to a sessions collection.
     The reading, filtering and writing of the data is handled by fill_table()
+    Orders of unknown products or sessions are dropped before they are written, see filter_references().
+
+    NOTE:
+    To fill the ordered table, the product and sessions tables are required!
 
     @params
     mongo_database: a connection to a MongoDB database
@@ -290,7 +426,11 @@ def fill_ordered_table(mongo_database, cursor):
     session_collection = ses.get_collection(mongo_database, "sessions")
     order_collection_labels = ["_id", "has_sale", ["order", "products"]]
     order_table_labels =  ['session_id', 'product_id']
-    fill_table('ordered', cursor, session_collection, order_collection_labels, order_table_labels, filters=[[0, "string"], "filter_orders"])
+    references = filter_references('ordered', [
+        (0, 'session_id', keys.load_keys(cursor, "session")),
+        (1, 'product_id', keys.load_keys(cursor, "product")),
+    ])
+    fill_table('ordered', cursor, session_collection, order_collection_labels, order_table_labels, filters=[[0, "string"], "filter_orders", references], scan_workers=SCAN_WORKERS)
 
 
 def fill_history_table(mongo_database, cursor):
@@ -298,6 +438,10 @@ def fill_history_table(mongo_database, cursor):
 
     This function will use a connection to a MongoDB to set up a connection to a visitors collection.
     The reading, filtering and writing of the data is handled by fill_table()
+    History of unknown profiles or products is dropped before it is written, see filter_references().
+
+    NOTE:
+    To fill the history table, the product and profiles tables are required!
 
     @params
     mongo_database: a connection to a MongoDB database
@@ -306,20 +450,115 @@ def fill_history_table(mongo_database, cursor):
     profile_collection = ses.get_collection(mongo_database, "visitors")
     history_collection_labels = ["_id", "previously_recommended", ["recommendations", "viewed_before"]]
     history_table_labels =  ['profile_id', 'product_id', 'history_type']
-    fill_table('history', cursor, profile_collection, history_collection_labels, history_table_labels, filters=[[0, "string"], "filter_history"])
+    references = filter_references('history', [
+        (0, 'profile_id', keys.load_keys(cursor, "profile")),
+        (1, 'product_id', keys.load_keys(cursor, "product")),
+    ])
+    fill_table('history', cursor, profile_collection, history_collection_labels, history_table_labels, filters=[[0, "string"], "filter_history", references], scan_workers=SCAN_WORKERS)
 
 def set_constraints(cursor):
     """Set constraints for database to make querries faster.
-    
+
+    The foreign keys are added as NOT VALID first, which only takes a short lock,
+    and are committed before they are validated, so the check of the existing rows does not block the tables.
+    Orphaned rows are already dropped while filling (see filter_references()), so nothing has to be deleted here.
+
+    NOTE:
+    This commits the transaction of the cursor.
+
     @params
     cursor: PostgreSQL cursor
     """
-    cursor.execute('''Delete from history where product_id not in (select product_id from product)''')
-    cursor.execute('''ALTER TABLE history ADD CONSTRAINT product_id FOREIGN KEY (product_id) REFERENCES product (product_id);''')
-    cursor.execute('''Delete from ordered where product_id not in (select product_id from product)''')
-    cursor.execute('''Delete from ordered where session_id not in (select session_id from sessions)''')
-    cursor.execute('''ALTER TABLE ordered ADD CONSTRAINT product_id FOREIGN KEY (product_id) REFERENCES product (product_id);''')
-    cursor.execute('''ALTER TABLE ordered ADD CONSTRAINT session_id FOREIGN KEY (session_id) REFERENCES sessions (session_id);''')
+    foreign_keys = [
+        ['history', 'product_id', 'product'],
+        ['ordered', 'product_id', 'product'],
+        ['ordered', 'session_id', 'sessions'],
+    ]
+    for table, column, referenced_table in foreign_keys:
+        cursor.execute(f'''ALTER TABLE {table} ADD CONSTRAINT {column} FOREIGN KEY ({column}) REFERENCES {referenced_table} ({column}) NOT VALID''')
+    cursor.connection.commit()
+    for table, column, referenced_table in foreign_keys:
+        cursor.execute(f'''ALTER TABLE {table} VALIDATE CONSTRAINT {column}''')
+        cursor.connection.commit()
+
+def load_table(table_name, postgres_settings, mongo_settings):
+    """Fill one table on its own connections
+
+    Used as worker by fill_tables(), so every table gets its own process,
+    MongoDB client and PostgreSQL connection. The table is committed when it is filled.
+
+    @params
+    table_name: name of the table, a key of TABLE_LOADERS
+    postgres_settings: dict of keyword arguments for connect.connect_db()
+    mongo_settings: dict with host, port and database_name of the MongoDB database
+
+    return: the measurements of this table, see instrumentation.Instrumentation.summary()
+    """
+    # worker processes are reused, so drop the measurements of the table loaded before
+    inst.metrics.reset()
+    connection = connect.connect_db(**postgres_settings)
+    client = None
+    try:
+        cursor = connection.cursor()
+        client = ses.get_client(host=mongo_settings["host"], port=mongo_settings["port"])
+        mongo_database = ses.get_database(client=client, database_name=mongo_settings["database_name"])
+        TABLE_LOADERS[table_name][0](mongo_database, cursor)
+        cursor.close()
+        connection.commit()
+    finally:
+        if client != None:
+            client.close()
+        connection.close()
+    inst.metrics.print_summary(f"fill {table_name}")
+    return inst.metrics.summary()
+
+def fill_tables(postgres_settings, mongo_settings, table_names=None, max_workers=None):
+    """Fill tables in parallel, respecting their dependencies
+
+    The dependencies in TABLE_LOADERS form a DAG.
+    A table is started as soon as all tables it depends on are filled,
+    so independent tables are filled at the same time in separate worker processes.
+    If a table fails, no new tables are started and the error is raised once the running tables are done.
+    The measurements of the workers are added to the shared instrumentation of this process.
+
+    @params
+    postgres_settings: dict of keyword arguments for connect.connect_db()
+    mongo_settings: dict with host, port and database_name of the MongoDB database
+    table_names: OPTIONAL list of tables to fill, by default all tables in TABLE_LOADERS
+    max_workers: OPTIONAL maximum amount of worker processes, by default the amount of CPUs
+    """
+    if table_names == None:
+        table_names = list(TABLE_LOADERS)
+    pending = {table_name: set(TABLE_LOADERS[table_name][1]) & set(table_names) for table_name in table_names}
+    done = set()
+    running = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for table_name, dependencies in list(pending.items()):
+                if dependencies <= done:
+                    running[executor.submit(load_table, table_name, postgres_settings, mongo_settings)] = table_name
+                    del pending[table_name]
+            if not running:
+                raise ValueError(f"circular table dependencies: {pending}")
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                table_name = running.pop(future)
+                if future.exception() != None:
+                    pending.clear()
+                    wait(running)
+                    raise RuntimeError(f"filling {table_name} failed") from future.exception()
+                inst.metrics.merge(future.result())
+                print(f"filled {table_name}")
+                done.add(table_name)
+
+# Each table with the function filling it and the tables that have to be filled first
+TABLE_LOADERS = {
+    'product': (fill_product_table, []),
+    'profiles': (fill_profiles_table, []),
+    'sessions': (fill_sessions_table, ['profiles']),
+    'ordered': (fill_ordered_table, ['product', 'sessions']),
+    'history': (fill_history_table, ['product', 'profiles']),
+}
 
 #################################################################################
 #                                                                               #
@@ -329,31 +568,40 @@ def set_constraints(cursor):
 #                                                                               #
 #################################################################################
 
-connection = connect.connect_db(host='localhost', database='opisop_sql', user='postgres', password='postgres')
-cursor = connection.cursor()
-mongo_database=ses.get_database(client=ses.get_client(host="Localhost", port=27017), database_name="opisop")
+postgres_settings = {'host': 'localhost', 'database': 'opisop_sql', 'user': 'postgres', 'password': 'postgres'}
+mongo_settings = {'host': 'Localhost', 'port': 27017, 'database_name': 'opisop'}
 
 #################################################################################
 #                                                                               #
 #                           How to fill the tables                              #
 #                                                                               #
-#                   Uncomment each line to fill the tables.                     #
-#               NOTE: you have to run profiles before sessions.                 #
+#     fill_tables() fills every table in TABLE_LOADERS, in parallel where       #
+#     possible. Pass table_names to fill only some of them.                     #
+#     NOTE: tables are filled after the tables they refer to,                   #
+#     eg. profiles before sessions and sessions before ordered.                 #
 #                                                                               #
 #################################################################################
 
+if __name__ == '__main__':
+    fill_tables(postgres_settings, mongo_settings)
 
-fill_product_table(mongo_database, cursor)
-fill_profiles_table(mongo_database, cursor)
-fill_sessions_table(mongo_database, cursor)
-fill_ordered_table(mongo_database, cursor)
-fill_history_table(mongo_database, cursor)
+    connection = connect.connect_db(**postgres_settings)
+    cursor = connection.cursor()
 
+    # Assuming youve filled all tables, run the line below to set the key constraints.
+    with inst.metrics.stage("set constraints"):
+        set_constraints(cursor)
 
-# Assuming youve filled all tables, run the line below to clean them up and set the key constraints.
-set_constraints(cursor)
+    # Build the indexes after all data is loaded, this also analyzes the tables.
+    with inst.metrics.stage("build indexes"):
+        tables.build_indexes(cursor)
 
+    # let running recommendation services drop their cached recommendations
+    cache.bump_version(cursor, "content")
+    cache.bump_version(cursor, "profile")
 
-# close cursor and commit connection at the end of the file.
-cursor.close()
-connection.commit()
+    # close cursor and commit connection at the end of the file.
+    cursor.close()
+    connection.commit()
+    # one summary of the whole run, the tables and the constraints and indexes
+    inst.metrics.print_summary("fill")
@@ -0,0 +1,197 @@
+##################################################################
+#                                                                #
+#   Timing, progress and round trip counters for the ETL         #
+#                                                                #
+#   Use the shared 'metrics' object, eg.                         #
+#       with metrics.stage("insert product") as stage:           #
+#           stage.add_rows(len(batch))                           #
+#   and call metrics.print_summary() at the end of a run.        #
+#   configure(enabled=False) turns everything into no-ops.       #
+#                                                                #
+##################################################################
+
+import json
+import time
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+class Stage:
+    """Timing and row count of one stage of the ETL, made by Instrumentation.stage()
+
+    @params
+    instrumentation: the Instrumentation the stage reports to
+    name: name of the stage
+    """
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.rows = 0
+        self.start = None
+        self.last_progress = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.last_progress = self.start
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        elapsed = time.perf_counter() - self.start
+        self.instrumentation.add_stage(self.name, elapsed, self.rows)
+        if self.instrumentation.output:
+            rows_per_second = self.rows / elapsed if elapsed > 0 else 0
+            print(f'{self.name}: {self.rows} rows in {elapsed:.2f}s ({rows_per_second:.0f} rows/s)')
+        return False
+
+    def add_rows(self, rows):
+        """Count processed rows, printing progress at most once per progress_interval seconds
+
+        @params
+        rows: amount of rows processed since the last call
+        """
+        self.rows += rows
+        if not self.instrumentation.output:
+            return
+        now = time.perf_counter()
+        if now - self.last_progress >= self.instrumentation.progress_interval:
+            self.last_progress = now
+            print(f'Progress: {self.name}: {self.rows} rows', end='\r')
+
+class NullStage:
+    """Stage used when instrumentation is disabled, does nothing"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+    def add_rows(self, rows):
+        pass
+
+NULL_STAGE = NullStage()
+
+class Instrumentation:
+    """Collects stage timings, row counts and database round trips of a run
+
+    @params
+    enabled: collect measurements (DEFAULT=True)
+    output: print progress and stage results (DEFAULT=True)
+    progress_interval: minimum seconds between progress prints of a stage (DEFAULT=1)
+    """
+    def __init__(self, enabled=True, output=True, progress_interval=1):
+        self.enabled = enabled
+        self.output = output and enabled
+        self.progress_interval = progress_interval
+        self.stages = {}
+        self.round_trips = {}
+        self.counters = {}
+        self.peak_memory_kb = None
+
+    def stage(self, name):
+        """Measure a stage, use as with block
+
+        @params
+        name: name of the stage, measurements of stages with the same name are added up
+
+        return: Stage
+        """
+        if not self.enabled:
+            return NULL_STAGE
+        return Stage(self, name)
+
+    def add_stage(self, name, seconds, rows):
+        """Add the measurements of a finished stage
+
+        @params
+        name: name of the stage
+        seconds: duration of the stage
+        rows: amount of rows processed by the stage
+        """
+        totals = self.stages.setdefault(name, {"seconds": 0.0, "rows": 0})
+        totals["seconds"] += seconds
+        totals["rows"] += rows
+
+    def round_trip(self, database, count=1):
+        """Count round trips to a database
+
+        @params
+        database: name of the database, eg. "postgresql" or "mongodb"
+        count: amount of round trips (DEFAULT=1)
+        """
+        if self.enabled:
+            self.round_trips[database] = self.round_trips.get(database, 0) + count
+
+    def count(self, name, amount=1):
+        """Add to a named counter, eg. the amount of rows dropped by a filter
+
+        @params
+        name: name of the counter
+        amount: amount added to the counter (DEFAULT=1)
+        """
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def summary(self):
+        """Get all measurements
+
+        return: dict with stages (seconds, rows, rows_per_second), round_trips, counters and peak_memory_kb
+        """
+        stages = {}
+        for name, totals in self.stages.items():
+            rows_per_second = totals["rows"] / totals["seconds"] if totals["seconds"] > 0 else 0
+            stages[name] = {"seconds": round(totals["seconds"], 3), "rows": totals["rows"], "rows_per_second": round(rows_per_second, 1)}
+        peak_memory_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource != None else None
+        if self.peak_memory_kb != None:
+            peak_memory_kb = max(peak_memory_kb or 0, self.peak_memory_kb)
+        return {"stages": stages, "round_trips": dict(self.round_trips), "counters": dict(self.counters), "peak_memory_kb": peak_memory_kb}
+
+    def merge(self, summary):
+        """Add the measurements of another process, eg. a worker of fill_database_table.fill_tables()
+
+        @params
+        summary: dict returned by summary() in the other process,
+            its peak_memory_kb counts as peak when it is higher than the peak of this process
+        """
+        if not self.enabled:
+            return
+        for name, totals in summary["stages"].items():
+            self.add_stage(name, totals["seconds"], totals["rows"])
+        for database, count in summary["round_trips"].items():
+            self.round_trip(database, count)
+        for name, amount in summary["counters"].items():
+            self.count(name, amount)
+        if summary["peak_memory_kb"] != None:
+            self.peak_memory_kb = max(self.peak_memory_kb or 0, summary["peak_memory_kb"])
+
+    def print_summary(self, label="etl"):
+        """Print the summary as one line of JSON, prefixed with 'METRICS'
+
+        @params
+        label: name of the run in the summary (DEFAULT=etl)
+        """
+        if self.enabled:
+            print('METRICS ' + json.dumps({"run": label, **self.summary()}))
+
+    def reset(self):
+        """Drop all measurements"""
+        self.stages = {}
+        self.round_trips = {}
+        self.counters = {}
+        self.peak_memory_kb = None
+
+# Instrumentation shared by the whole process
+metrics = Instrumentation()
+
+def configure(enabled=True, output=True, progress_interval=1):
+    """Configure the shared instrumentation
+
+    @params
+    enabled: collect measurements, False makes all instrumentation calls no-ops (DEFAULT=True)
+    output: print progress and stage results (DEFAULT=True)
+    progress_interval: minimum seconds between progress prints of a stage (DEFAULT=1)
+    """
+    metrics.enabled = enabled
+    metrics.output = output and enabled
+    metrics.progress_interval = progress_interval
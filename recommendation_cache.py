@@ -0,0 +1,142 @@
+##################################################################
+#                                                                #
+#   In-process cache for recommendations, used by the            #
+#   RecommendationService in recommendation_engine.py            #
+#                                                                #
+##################################################################
+
+import threading
+import time
+from collections import OrderedDict
+
+# Returned by RecommendationCache.get() when a key is not cached
+MISSING = object()
+
+VERSIONS_QUERY = 'SELECT name, version FROM recommendation_version'
+
+def bump_version(cursor, name):
+    """Bump the version of cached recommendations
+
+    Call this after regenerating the data behind the recommendations,
+    every RecommendationCache watching this version will drop its entries.
+    The new version is visible once the transaction of the cursor is committed.
+
+    @params
+    cursor: PostgreSQL cursor
+    name: name of the version, "content" or "profile"
+    """
+    cursor.execute(
+    '''INSERT INTO recommendation_version (name, version) VALUES (%s, 1)
+        ON CONFLICT (name) DO UPDATE SET version = recommendation_version.version + 1''',
+        [name]
+    )
+
+def get_versions(cursor):
+    """Get the current version of all cached recommendations
+
+    @params
+    cursor: PostgreSQL cursor
+
+    return: dict of {name: version}
+    """
+    cursor.execute(VERSIONS_QUERY)
+    return dict(cursor.fetchall())
+
+class RecommendationCache:
+    """Bounded LRU cache with a time to live per entry
+
+    When the cache is full, the least recently used entry is evicted.
+    Entries older than ttl seconds are not returned.
+    All entries belong to a version (see bump_version()),
+    when set_version() gets a different version all entries are dropped.
+
+    @params
+    max_size: maximum amount of entries, 0 disables the cache (DEFAULT=10000)
+    ttl: seconds an entry stays valid (DEFAULT=300)
+    """
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Get a cached value
+
+        @params
+        key: hashable key of the entry
+
+        return: cached value, or MISSING when there is no valid entry
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                self.misses += 1
+                return MISSING
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, version=MISSING):
+        """Cache a value, evicting the least recently used entry when full
+
+        @params
+        key: hashable key of the entry
+        value: value that is cached
+        version: OPTIONAL version the value was computed for,
+            the value is not cached when the version changed in the meantime
+        """
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            if version is not MISSING and version != self.version:
+                return
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def set_version(self, version):
+        """Set the version of the data behind the cache, a new version drops all entries
+
+        @params
+        version: current version, see get_versions()
+        """
+        with self.lock:
+            if version == self.version:
+                return
+            if self.version is not None:
+                self.invalidations += 1
+            self.version = version
+            self.entries.clear()
+
+    def clear(self):
+        """Drop all entries"""
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """Get counters of the cache
+
+        return: dict with size, hits, misses, evictions, invalidations and version
+        """
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "version": self.version,
+            }
@@ -4,35 +4,414 @@
 #                                          #
 ############################################
 
+import threading
+import time
+
 import PostgreSQL.connect_db as connect
 import PostgreSQL.select as sel
+import recommendation_cache as cache
+import exclusion_filter as exclusion
+import recommendation_snapshot as snapshot
+
+# Statements are executed as prepared statements (see PostgreSQL/select.py),
+# so each connection plans them once instead of on every request.
+# The tables store integer keys (see surrogate_keys.py), the statements translate
+# the requested ids into keys and the recommended keys back into ids.
+
+# Turns an array of product keys into an array of product ids, keeping the order
+PRODUCT_IDS = '''ARRAY(
+            SELECT k.source_id
+            FROM unnest({}) WITH ORDINALITY AS u(product_id, position), product_keys AS k
+            WHERE k.product_id=u.product_id
+            ORDER BY u.position
+        )'''
+
+CONTENT_RECOMMENDATIONS_STATEMENT = '''SELECT ''' + PRODUCT_IDS.format('''(array_remove(
+            CASE WHEN array_length(g.top_product_ids, 1) > %(amount)s THEN g.top_product_ids ELSE g.product_ids END,
+            r.product_id
+        ))[1:%(amount)s]''') + '''
+    FROM product_keys AS p, content_rule AS r, content_group AS g
+    WHERE p.source_id=%(product_id)s AND r.product_id=p.product_id AND r.group_id=g.group_id'''
+
+# {profile_id} is filled in with the expression giving the profile key
+PROFILE_RECOMMENDATIONS_QUERY = '''SELECT k.source_id AS product_id, p.category, p.sub_category, p.repeat_product, p.fast_mover, p.stock, p.discount,
+            COUNT(profile_id) AS product_frequency
+        FROM sessions AS s, ordered AS o, product AS p, product_keys AS k
+        WHERE s.session_id=o.session_id
+            AND p.product_id=o.product_id
+            AND k.product_id=p.product_id
+            AND profile_id IN (
+                SELECT profile_id
+                FROM(
+                    SELECT s.profile_id,
+                        COUNT(o.product_id) AS total
+                    FROM sessions AS s,
+                        ordered AS o
+                    WHERE s.session_id=o.session_id
+                        AND (o.product_id IN(
+                            SELECT o.product_id
+                            FROM sessions AS s, ordered AS o
+                            WHERE s.session_id=o.session_id AND s.profile_id={profile_id}))
+                        AND NOT (s.profile_id={profile_id})
+                    GROUP BY s.profile_id
+                    ORDER BY total DESC) AS table1
+                LIMIT %(comparative_user_amount)s
+            )
+            AND o.product_id NOT IN(
+                SELECT o.product_id
+                FROM sessions AS s, ordered AS o
+                WHERE s.session_id=o.session_id AND s.profile_id={profile_id}
+            )
+        GROUP BY p.product_id, k.source_id
+        ORDER BY product_frequency DESC, stock DESC, discount ASC, repeat_product DESC, fast_mover DESC
+        LIMIT %(recommendation_amount)s'''
+
+PROFILE_RECOMMENDATIONS_STATEMENT = PROFILE_RECOMMENDATIONS_QUERY.format(profile_id='(SELECT pk.profile_id FROM profile_keys AS pk WHERE pk.source_id=%(profile_id)s)')
+
+CO_PURCHASE_RECOMMENDATIONS_STATEMENT = '''SELECT ''' + PRODUCT_IDS.format('c.recommended_product_ids[1:%(amount)s]') + '''
+    FROM product_keys AS p, co_purchase AS c
+    WHERE p.source_id=%(product_id)s AND c.product_id=p.product_id'''
+
+# Batch versions of the statements above, resolving many ids in one round trip
+CONTENT_RECOMMENDATIONS_BATCH_STATEMENT = '''SELECT p.source_id, ''' + PRODUCT_IDS.format('''(array_remove(
+            CASE WHEN array_length(g.top_product_ids, 1) > %(amount)s THEN g.top_product_ids ELSE g.product_ids END,
+            r.product_id
+        ))[1:%(amount)s]''') + '''
+    FROM product_keys AS p, content_rule AS r, content_group AS g
+    WHERE p.source_id = ANY(%(product_ids)s::varchar[]) AND r.product_id=p.product_id AND r.group_id=g.group_id'''
+
+PROFILE_RECOMMENDATIONS_BATCH_STATEMENT = f'''SELECT u.source_id, (
+        SELECT array_agg(q.product_id ORDER BY q.product_frequency DESC, q.stock DESC, q.discount ASC, q.repeat_product DESC, q.fast_mover DESC)
+        FROM ({PROFILE_RECOMMENDATIONS_QUERY.format(profile_id='t.profile_id')}) AS q
+    )
+    FROM unnest(%(profile_ids)s::varchar[]) AS u(source_id) LEFT JOIN profile_keys AS t ON t.source_id=u.source_id'''
+
+class RecommendationServiceBase:
+    """Parts shared by RecommendationService and AsyncRecommendationService (see async_recommendation_engine.py)
+
+    Subclasses set content_cache, profile_cache and exclusion_filter.
+    """
+    def get_excluded(self, profile_id):
+        """Get the products that should not be recommended to a profile
+
+        @params
+        profile_id: the id of the user, OPTIONAL
+
+        return: excluded product ids supporting len() and in, empty without profile_id or exclusion_filter
+        """
+        if profile_id is None or self.exclusion_filter is None:
+            return set()
+        return self.exclusion_filter.excluded(profile_id)
+
+    def set_versions(self, versions):
+        """Drop cached recommendations of which the version changed
+
+        @params
+        versions: dict of {name: version}, see recommendation_cache.get_versions()
+        """
+        self.content_cache.set_version(versions.get("content", 0))
+        self.profile_cache.set_version(versions.get("profile", 0))
+
+    def cache_stats(self):
+        """Get counters of the recommendation caches
+
+        return: dict of {"content": stats, "profile": stats}, see RecommendationCache.stats()
+        """
+        return {"content": self.content_cache.stats(), "profile": self.profile_cache.stats()}
+
+class RecommendationService(RecommendationServiceBase):
+    """Long-lived recommendation service
+
+    All requests share one thread-safe connection pool,
+    so a request does not have to set up a new connection to PostgreSQL.
+    Create one service per process and reuse it, call close() when shutting down.
+
+    When a profile_model is given (see collaborative_filtering.py),
+    profile recommendations are computed from that model in memory instead of querried from PostgreSQL.
+
+    When an exclusion_filter is given (see exclusion_filter.py), products in the history of a profile
+    are left out of its recommendations. exclusion_filter.EXCLUSION_MARGIN extra recommendations are fetched to make up for them,
+    more only when too few are left.
+
+    When a snapshot_path is given (see recommendation_snapshot.py), content and bought together recommendations
+    are read from the memory mapped snapshot instead of PostgreSQL. A new snapshot exported to the same path
+    is picked up within recommendation_snapshot.CHECK_INTERVAL seconds.
+    When the content was regenerated after the snapshot was exported, they are querried from PostgreSQL
+    until a new snapshot is exported.
+
+    Recommendations are cached in process (see recommendation_cache.py).
+    At most once per version_check_interval seconds the service checks if content_rule.py
+    or fill_database_table.py regenerated the data, if so the cached recommendations are dropped.
+
+    @params
+    host: string of host (DEFAULT=localhost)
+    database: string of database (DEFAULT=opisop_sql)
+    user: string of database user (DEFAULT=postgres)
+    password: string form of database password (DEFAULT=postgres)
+    min_connections: amount of connections kept open (DEFAULT=1)
+    max_connections: maximum amount of connections open at the same time (DEFAULT=10)
+    health_check_interval: idle seconds after which a connection is checked before use (DEFAULT=30)
+    cache_size: maximum amount of cached recommendations per type, 0 disables caching (DEFAULT=10000)
+    cache_ttl: seconds a cached recommendation stays valid (DEFAULT=300)
+    version_check_interval: seconds between checks for regenerated data (DEFAULT=5)
+    profile_model: OPTIONAL ProfileModel used for profile recommendations
+    exclusion_filter: OPTIONAL ExclusionFilter with the products to leave out per profile
+    snapshot_path: OPTIONAL path of a snapshot file used for content and bought together recommendations
+    query_stats: OPTIONAL QueryStats measuring every statement of the service, see PostgreSQL/query_stats.py
+    """
+    def __init__(self, host='localhost', database='opisop_sql', user='postgres', password='postgres', min_connections=1, max_connections=10, health_check_interval=30,
+                 cache_size=10000, cache_ttl=300, version_check_interval=5, profile_model=None, exclusion_filter=None, snapshot_path=None, query_stats=None):
+        self.pool = connect.ConnectionPool(host, database, user, password, min_connections=min_connections, max_connections=max_connections,
+                                           health_check_interval=health_check_interval, query_stats=query_stats)
+        self.content_cache = cache.RecommendationCache(cache_size, cache_ttl)
+        self.profile_cache = cache.RecommendationCache(cache_size, cache_ttl)
+        self.version_check_interval = version_check_interval
+        self.version_checked = None
+        self.version_lock = threading.Lock()
+        self.profile_model = profile_model
+        self.exclusion_filter = exclusion_filter
+        self.snapshot = snapshot.SnapshotFile(snapshot_path) if snapshot_path is not None else None
+
+    def get_snapshot(self):
+        """Get the snapshot, if it is as new as the content in PostgreSQL
+
+        Call check_versions() first, the snapshot is compared with the content version it read.
+
+        return: RecommendationSnapshot, None without snapshot_path or when the content was regenerated
+            (eg. by content_rule.py or sync_database.py) after the snapshot was exported
+        """
+        if self.snapshot is None:
+            return None
+        current_snapshot = self.snapshot.get()
+        if current_snapshot.version < (self.content_cache.version or 0):
+            return None
+        return current_snapshot
+
+    def check_versions(self):
+        """Drop cached recommendations when the data behind them has been regenerated
+
+        The versions are read from PostgreSQL at most once per version_check_interval seconds.
+        """
+        with self.version_lock:
+            now = time.monotonic()
+            if self.version_checked is not None and now - self.version_checked < self.version_check_interval:
+                return
+            self.version_checked = now
+        with self.pool.connection() as connection, connection.cursor() as cursor:
+            versions = cache.get_versions(cursor)
+        self.set_versions(versions)
+
+    def get_content_recommendations(self, product_id, ammount, profile_id=None):
+        """Retrieve content recommendation, see get_content_recommendations()
+
+        @params
+        product_id: product_id for the product that needs recommendations
+        amount: the maximum amount of recommendations returned
+        profile_id: OPTIONAL id of the user the recommendations are for, products in its history are left out
+
+        returns: list of product ids corresponding to the request
+        """
+        excluded = self.get_excluded(profile_id)
+        fetch_amount = exclusion.get_fetch_amount(ammount, excluded)
+        recommended_product_ids = self.fetch_content_recommendations(product_id, fetch_amount)
+        recommendations = exclusion.exclude(recommended_product_ids, excluded, ammount)
+        if exclusion.needs_more(recommended_product_ids, recommendations, fetch_amount, ammount, excluded):
+            recommendations = exclusion.exclude(self.fetch_content_recommendations(product_id, ammount + len(excluded)), excluded, ammount)
+        return recommendations
+
+    def fetch_content_recommendations(self, product_id, ammount):
+        """Get content recommendation from the snapshot, the cache or PostgreSQL, without leaving products out
+
+        @params
+        product_id: product_id for the product that needs recommendations
+        amount: the maximum amount of recommendations returned
+
+        returns: list of product ids
+        """
+        self.check_versions()
+        current_snapshot = self.get_snapshot()
+        if current_snapshot is not None:
+            return current_snapshot.get_content_recommendations(product_id, ammount)
+        key = (product_id, ammount)
+        recommended_product_ids = self.content_cache.get(key)
+        if recommended_product_ids is cache.MISSING:
+            version = self.content_cache.version
+            with self.pool.connection() as connection, connection.cursor() as cursor:
+                sel.execute_prepared(cursor, CONTENT_RECOMMENDATIONS_STATEMENT, {"product_id": product_id, "amount": ammount})
+                recommended_product_ids = cursor.fetchone()
+            recommended_product_ids = [] if recommended_product_ids is None else recommended_product_ids[0] # stupid SQL nesting
+            self.content_cache.put(key, recommended_product_ids, version)
+        return list(recommended_product_ids)
+
+    def get_profile_recommendations(self, profile_id, comparative_user_ammount, recommendation_amount):
+        """get recomendation for given profile, see get_profile_recommendations()
+
+        @params
+        profile_id: the id of the user that needs recommendations
+        comparative_user_amounts: the amount of users the profile is compared to
+        recommendation_amount: amount of products returned at the end
+
+        return: list of product ids with the maximal length of 'recommendation_amount'
+        """
+        excluded = self.get_excluded(profile_id)
+        fetch_amount = exclusion.get_fetch_amount(recommendation_amount, excluded)
+        recommended_product_ids = self.fetch_profile_recommendations(profile_id, comparative_user_ammount, fetch_amount)
+        recommendations = exclusion.exclude(recommended_product_ids, excluded, recommendation_amount)
+        if exclusion.needs_more(recommended_product_ids, recommendations, fetch_amount, recommendation_amount, excluded):
+            recommended_product_ids = self.fetch_profile_recommendations(profile_id, comparative_user_ammount, recommendation_amount + len(excluded))
+            recommendations = exclusion.exclude(recommended_product_ids, excluded, recommendation_amount)
+        return recommendations
 
-def get_content_recommendations(product_id, ammount):
+    def fetch_profile_recommendations(self, profile_id, comparative_user_ammount, recommendation_amount):
+        """Get profile recommendations from the cache, the profile model or PostgreSQL, without leaving products out
+
+        @params
+        profile_id: the id of the user that needs recommendations
+        comparative_user_amounts: the amount of users the profile is compared to
+        recommendation_amount: amount of products returned at the end
+
+        return: list of product ids
+        """
+        self.check_versions()
+        key = (profile_id, comparative_user_ammount, recommendation_amount)
+        recommended_product_ids = self.profile_cache.get(key)
+        if recommended_product_ids is cache.MISSING and self.profile_model is not None:
+            recommended_product_ids = self.profile_model.recommend(profile_id, comparative_user_ammount, recommendation_amount)
+            self.profile_cache.put(key, recommended_product_ids)
+        elif recommended_product_ids is cache.MISSING:
+            version = self.profile_cache.version
+            with self.pool.connection() as connection, connection.cursor() as cursor:
+                sel.execute_prepared(cursor, PROFILE_RECOMMENDATIONS_STATEMENT, {"profile_id": profile_id, "comparative_user_amount": comparative_user_ammount, "recommendation_amount": recommendation_amount})
+                recommended_product_ids = [x[0] for x in cursor.fetchall()]
+            self.profile_cache.put(key, recommended_product_ids, version)
+        return list(recommended_product_ids)
+
+    def get_co_purchase_recommendations(self, product_id, ammount):
+        """Retrieve bought together recommendation, see get_co_purchase_recommendations()
+
+        @params
+        product_id: product_id for the product that needs recommendations
+        amount: the maximum amount of recommendations returned
+
+        returns: list of product ids corresponding to the request
+        """
+        self.check_versions()
+        current_snapshot = self.get_snapshot()
+        if current_snapshot is not None:
+            return current_snapshot.get_co_purchase_recommendations(product_id, ammount)
+        key = ("co_purchase", product_id, ammount)
+        recommended_product_ids = self.content_cache.get(key)
+        if recommended_product_ids is cache.MISSING:
+            version = self.content_cache.version
+            with self.pool.connection() as connection, connection.cursor() as cursor:
+                sel.execute_prepared(cursor, CO_PURCHASE_RECOMMENDATIONS_STATEMENT, {"product_id": product_id, "amount": ammount})
+                recommended_product_ids = cursor.fetchone()
+            recommended_product_ids = [] if recommended_product_ids is None else recommended_product_ids[0] or []
+            self.content_cache.put(key, recommended_product_ids, version)
+        return list(recommended_product_ids)
+
+    def get_content_recommendations_batch(self, product_ids, ammount):
+        """Retrieve content recommendations for multiple products, see get_content_recommendations_batch()
+
+        @params
+        product_ids: list of product_ids that need recommendations
+        amount: the maximum amount of recommendations returned per product
+
+        returns: dict of {product_id: list of recommended product ids}
+        """
+        self.check_versions()
+        current_snapshot = self.get_snapshot()
+        if current_snapshot is not None:
+            return {product_id: current_snapshot.get_content_recommendations(product_id, ammount) for product_id in product_ids}
+        recommendations = {}
+        for product_id in product_ids:
+            recommended_product_ids = self.content_cache.get((product_id, ammount))
+            recommendations[product_id] = None if recommended_product_ids is cache.MISSING else list(recommended_product_ids)
+        missing = [product_id for product_id, recommended_product_ids in recommendations.items() if recommended_product_ids is None]
+        if not missing:
+            return recommendations
+        version = self.content_cache.version
+        for product_id in missing:
+            recommendations[product_id] = []
+        with self.pool.connection() as connection, connection.cursor() as cursor:
+            sel.execute_prepared(cursor, CONTENT_RECOMMENDATIONS_BATCH_STATEMENT, {"product_ids": missing, "amount": ammount})
+            for product_id, recommended_product_ids in cursor.fetchall():
+                recommendations[product_id] = recommended_product_ids
+        for product_id in missing:
+            self.content_cache.put((product_id, ammount), list(recommendations[product_id]), version)
+        return recommendations
+
+    def get_profile_recommendations_batch(self, profile_ids, comparative_user_ammount, recommendation_amount):
+        """get recomendations for multiple profiles, see get_profile_recommendations_batch()
+
+        @params
+        profile_ids: list of ids of the users that need recommendations
+        comparative_user_amounts: the amount of users each profile is compared to
+        recommendation_amount: amount of products returned per profile
+
+        return: dict of {profile_id: list of product ids with the maximal length of 'recommendation_amount'}
+        """
+        self.check_versions()
+        recommendations = {}
+        for profile_id in profile_ids:
+            recommended_product_ids = self.profile_cache.get((profile_id, comparative_user_ammount, recommendation_amount))
+            recommendations[profile_id] = None if recommended_product_ids is cache.MISSING else list(recommended_product_ids)
+        missing = [profile_id for profile_id, recommended_product_ids in recommendations.items() if recommended_product_ids is None]
+        if not missing:
+            return recommendations
+        version = self.profile_cache.version
+        if self.profile_model is not None:
+            for profile_id in missing:
+                recommendations[profile_id] = self.profile_model.recommend(profile_id, comparative_user_ammount, recommendation_amount)
+                self.profile_cache.put((profile_id, comparative_user_ammount, recommendation_amount), list(recommendations[profile_id]))
+            return recommendations
+        with self.pool.connection() as connection, connection.cursor() as cursor:
+            sel.execute_prepared(cursor, PROFILE_RECOMMENDATIONS_BATCH_STATEMENT, {"profile_ids": missing, "comparative_user_amount": comparative_user_ammount, "recommendation_amount": recommendation_amount})
+            for profile_id, recommended_product_ids in cursor.fetchall():
+                recommendations[profile_id] = recommended_product_ids or []
+        for profile_id in missing:
+            self.profile_cache.put((profile_id, comparative_user_ammount, recommendation_amount), list(recommendations[profile_id]), version)
+        return recommendations
+
+    def close(self):
+        """Close all connections of the service"""
+        self.pool.close()
+
+default_service = None
+default_service_lock = threading.Lock()
+
+def get_default_service():
+    """Get the recommendation service shared by this process
+
+    The service is created on first use, with the default connection settings.
+
+    return: RecommendationService
+    """
+    global default_service
+    with default_service_lock:
+        if default_service is None:
+            default_service = RecommendationService()
+        return default_service
+
+def get_content_recommendations(product_id, ammount, profile_id=None):
     """Retrieve content recommendation
-    
-    As our content recommendation is pregenerated into the content_rule table,
-    this function will try to fetch the first 'amount' of recommendations from said table.
-    
+
+    As our content recommendation is pregenerated into the content_rule and content_group tables,
+    this function will try to fetch the first 'amount' of products of the group the product belongs to,
+    excluding the product itself.
+
     If a product has less then 'amount' of recommendations, less will be returned
     If a product does not have any recommmendations an empty array will return
 
     @params
     product_id: product_id for the product that needs recommendations
     amount: the maximum amount of recommendations returned
+    profile_id: OPTIONAL id of the user the recommendations are for, products in its history are left out
+        when the service has an exclusion filter (see RecommendationService)
 
     returns: list of product ids corresponding to the request
     """
-    connection = connect.connect_db(host='localhost', database='opisop_sql', user='postgres', password='postgres')
-    cursor = connection.cursor()
-
-    recommended_product_ids = sel.postgresql_select(cursor, ["recommended_product_ids"], "content_rule", [f"product_id = '{product_id}'"])
-    try:
-        recommended_product_ids = recommended_product_ids[0][0] # stupid SQL nesting
-        connection.close()
-        cursor.close()
-        return recommended_product_ids[:ammount]
-    except IndexError:
-        return []
+    return get_default_service().get_content_recommendations(product_id, ammount, profile_id)
 
 def get_profile_recommendations(profile_id, comparative_user_ammount, recommendation_amount):
     """get recomendation for given profile
@@ -50,44 +429,50 @@ def get_profile_recommendations(profile_id, comparative_user_ammount, recommenda
 
     return: list of product ids with the maximal length of 'recommendation_amount'
     """
-    connection = connect.connect_db(host='localhost', database='opisop_sql', user='postgres', password='postgres')
-    cursor = connection.cursor()
+    return get_default_service().get_profile_recommendations(profile_id, comparative_user_ammount, recommendation_amount)
 
-    cursor.execute(
-    f'''SELECT p.product_id, p.category, p.sub_category, p.repeat_product, p.fast_mover, p.stock, p.discount,
-            COUNT(profile_id) AS product_frequency
-        FROM sessions AS s, ordered AS o, product AS p
-        WHERE s.session_id=o.session_id 
-            AND p.product_id=o.product_id
-            AND profile_id IN (
-                SELECT profile_id
-                FROM(
-                    SELECT s.profile_id, 
-                        COUNT(o.product_id) AS total
-                    FROM sessions AS s, 
-                        ordered AS o
-                    WHERE s.session_id=o.session_id 
-                        AND (o.product_id IN(
-                            SELECT o.product_id
-                            FROM sessions AS s, ordered AS o
-                            WHERE s.session_id=o.session_id AND s.profile_id='{profile_id}'))
-                        AND NOT (s.profile_id='{profile_id}')
-                    GROUP BY s.profile_id 
-                    ORDER BY total DESC) AS table1
-                LIMIT {comparative_user_ammount}
-            )
-            AND o.product_id NOT IN(
-                SELECT o.product_id
-                FROM sessions AS s, ordered AS o
-                WHERE s.session_id=o.session_id AND s.profile_id='{profile_id}'
-            )    
-        GROUP BY p.product_id
-        ORDER BY product_frequency DESC, stock DESC, discount ASC, repeat_product DESC, fast_mover DESC
-        LIMIT {recommendation_amount}'''
-    )
-    recommended_product_ids = cursor.fetchall()
-    recommended_product_ids = [x[0] for x in recommended_product_ids]
+def get_co_purchase_recommendations(product_id, ammount):
+    """Retrieve bought together recommendation
+
+    The products most often ordered in the same session as the product are pregenerated
+    into the co_purchase table (see co_purchase.py), this function fetches the first 'amount' of them.
+
+    If a product has less then 'amount' of recommendations, less will be returned
+    If a product does not have any recommmendations an empty array will return
+
+    @params
+    product_id: product_id for the product that needs recommendations
+    amount: the maximum amount of recommendations returned
 
-    connection.close()
-    cursor.close()
-    return recommended_product_ids
\ No newline at end of file
+    returns: list of product ids corresponding to the request
+    """
+    return get_default_service().get_co_purchase_recommendations(product_id, ammount)
+
+def get_content_recommendations_batch(product_ids, ammount):
+    """Retrieve content recommendations for multiple products at once
+
+    Works like get_content_recommendations(), but all products are resolved in one querry.
+    Every requested product_id is in the result, products without recommendations get an empty array.
+
+    @params
+    product_ids: list of product_ids that need recommendations
+    amount: the maximum amount of recommendations returned per product
+
+    returns: dict of {product_id: list of recommended product ids}
+    """
+    return get_default_service().get_content_recommendations_batch(product_ids, ammount)
+
+def get_profile_recommendations_batch(profile_ids, comparative_user_ammount, recommendation_amount):
+    """get recomendations for multiple profiles at once
+
+    Works like get_profile_recommendations(), but all profiles are resolved in one querry.
+    Every requested profile_id is in the result, profiles without recommendations get an empty array.
+
+    @params
+    profile_ids: list of ids of the users that need recommendations
+    comparative_user_amounts: the amount of users each profile is compared to
+    recommendation_amount: amount of products returned per profile
+
+    return: dict of {profile_id: list of product ids with the maximal length of 'recommendation_amount'}
+    """
+    return get_default_service().get_profile_recommendations_batch(profile_ids, comparative_user_ammount, recommendation_amount)
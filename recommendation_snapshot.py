@@ -0,0 +1,330 @@
+###################################################################
+#                                                                 #
+#   Use this file to export a snapshot of the recommendations     #
+#                                                                 #
+#   The content groups, bought together lists and product ids     #
+#   are written to one binary file. The RecommendationService in  #
+#   recommendation_engine.py memory maps it, so starting a worker #
+#   does not read anything from PostgreSQL, and all workers on a  #
+#   machine share the same pages of the file.                     #
+#                                                                 #
+#   File layout: MAGIC, 8 byte little endian header length, JSON  #
+#   header, then every array at an offset aligned to ALIGNMENT.   #
+#                                                                 #
+###################################################################
+
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+import PostgreSQL.connect_db as connect
+import recommendation_cache as cache
+
+MAGIC = b'RECSNAP1'
+
+# Format version in the header, snapshots of another format are refused
+FORMAT_VERSION = 1
+
+ALIGNMENT = 64
+
+# Seconds between checks for a new snapshot file, see SnapshotFile
+CHECK_INTERVAL = 5
+
+class RecommendationSnapshot:
+    """Read-only view on a snapshot file written by export_snapshot()
+
+    All arrays are views on the memory mapped file, opening a snapshot only reads its header.
+    Products are stored by their key (see surrogate_keys.py):
+        product_ids: the id of key k is product_id_data[product_id_offsets[k]:product_id_offsets[k+1]]
+        product_id_order: keys sorted on their id, to find the key of an id
+        product_group: content group of each key, -1 without group
+        group_products: keys of group g are group_products[group_offsets[g]:group_offsets[g+1]]
+        co_purchase_products: bought together keys of key k are co_purchase_products[co_purchase_offsets[k]:co_purchase_offsets[k+1]]
+
+    @params
+    path: path of the snapshot file
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mmap[:len(MAGIC)] != MAGIC:
+            self.mmap.close()
+            raise ValueError(f"{path} is not a recommendation snapshot")
+        header_length = struct.unpack_from('<Q', self.mmap, len(MAGIC))[0]
+        start = len(MAGIC) + 8
+        self.header = json.loads(self.mmap[start:start+header_length].decode())
+        if self.header["format_version"] != FORMAT_VERSION:
+            self.mmap.close()
+            raise ValueError(f"{path} has snapshot format {self.header['format_version']}, expected {FORMAT_VERSION}")
+        self.version = self.header["version"]
+        self.arrays = {}
+        for name, array in self.header["arrays"].items():
+            self.arrays[name] = np.frombuffer(self.mmap, dtype=array["dtype"], count=array["length"], offset=array["offset"])
+
+    def get_product_id(self, key):
+        """Get the product id of a key
+
+        @params
+        key: product key
+
+        return: product id
+        """
+        offsets = self.arrays["product_id_offsets"]
+        return self.arrays["product_id_data"][offsets[key]:offsets[key+1]].tobytes().decode()
+
+    def get_key(self, product_id):
+        """Get the key of a product id, with a binary search over product_id_order
+
+        @params
+        product_id: product id
+
+        return: product key, None if the product is not in the snapshot
+        """
+        order = self.arrays["product_id_order"]
+        low, high = 0, len(order)
+        while low < high:
+            middle = (low + high) // 2
+            if self.get_product_id(order[middle]) < product_id:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(order) and self.get_product_id(order[low]) == product_id:
+            return int(order[low])
+        return None
+
+    def get_product_ids(self, keys, amount, skip_key=None):
+        """Get the product ids of the first keys
+
+        @params
+        keys: array of product keys, best first
+        amount: maximum amount of product ids
+        skip_key: OPTIONAL key that is left out, eg. the requested product
+
+        return: list of product ids
+        """
+        product_ids = []
+        for key in keys:
+            if len(product_ids) >= amount:
+                break
+            if key != skip_key:
+                product_ids.append(self.get_product_id(key))
+        return product_ids
+
+    def get_content_recommendations(self, product_id, ammount):
+        """Retrieve content recommendation, the same as CONTENT_RECOMMENDATIONS_STATEMENT in recommendation_engine.py
+
+        @params
+        product_id: product_id for the product that needs recommendations
+        amount: the maximum amount of recommendations returned
+
+        returns: list of product ids corresponding to the request
+        """
+        key = self.get_key(product_id)
+        if key is None or key >= len(self.arrays["product_group"]) or self.arrays["product_group"][key] < 0:
+            return []
+        group = self.arrays["product_group"][key]
+        offsets = self.arrays["group_offsets"]
+        return self.get_product_ids(self.arrays["group_products"][offsets[group]:offsets[group+1]], ammount, skip_key=key)
+
+    def get_co_purchase_recommendations(self, product_id, ammount):
+        """Retrieve bought together recommendation, the same as CO_PURCHASE_RECOMMENDATIONS_STATEMENT in recommendation_engine.py
+
+        @params
+        product_id: product_id for the product that needs recommendations
+        amount: the maximum amount of recommendations returned
+
+        returns: list of product ids corresponding to the request
+        """
+        key = self.get_key(product_id)
+        offsets = self.arrays["co_purchase_offsets"]
+        if key is None or key + 1 >= len(offsets):
+            return []
+        return self.get_product_ids(self.arrays["co_purchase_products"][offsets[key]:offsets[key+1]], ammount)
+
+    def close(self):
+        """Close the memory map, the arrays of this snapshot can not be used after this"""
+        self.arrays = {}
+        self.mmap.close()
+
+class SnapshotFile:
+    """The newest snapshot at a path
+
+    export_snapshot() replaces the file atomically. At most once per check_interval seconds
+    the file is checked, and when it was replaced the new snapshot is opened.
+    The old snapshot is left to the garbage collector, so requests still using it can finish.
+
+    @params
+    path: path of the snapshot file
+    check_interval: seconds between checks for a new snapshot (DEFAULT=CHECK_INTERVAL)
+    """
+    def __init__(self, path, check_interval=CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.checked = time.monotonic()
+        self.file_id = self.get_file_id()
+        self.snapshot = RecommendationSnapshot(path)
+
+    def get_file_id(self):
+        """Get what identifies the current file at path
+
+        return: tuple of (device, inode, modification time)
+        """
+        stat = os.stat(self.path)
+        return (stat.st_dev, stat.st_ino, stat.st_mtime_ns)
+
+    def get(self):
+        """Get the newest snapshot
+
+        return: RecommendationSnapshot
+        """
+        with self.lock:
+            now = time.monotonic()
+            if now - self.checked >= self.check_interval:
+                self.checked = now
+                file_id = self.get_file_id()
+                if file_id != self.file_id:
+                    self.snapshot = RecommendationSnapshot(self.path)
+                    self.file_id = file_id
+            return self.snapshot
+
+def get_offsets(lists, length):
+    """Flatten lists stored per index into one array with offsets
+
+    @params
+    lists: dict of {index: list of ints}
+    length: amount of indexes
+
+    return: tuple of (int64 array of length + 1 offsets, int32 array of all values)
+    """
+    offsets = np.zeros(length + 1, dtype=np.int64)
+    for index, values in lists.items():
+        offsets[index + 1] = len(values)
+    np.cumsum(offsets, out=offsets)
+    values = np.zeros(offsets[-1], dtype=np.int32)
+    for index, index_values in lists.items():
+        values[offsets[index]:offsets[index+1]] = index_values
+    return offsets, values
+
+def get_snapshot_arrays(cursor):
+    """Read the recommendation data from PostgreSQL into the arrays of a snapshot
+
+    @params
+    cursor: PostgreSQL cursor
+
+    return: dict of {name: numpy array}, see RecommendationSnapshot
+    """
+    cursor.execute('SELECT product_id, source_id FROM product_keys')
+    product_keys = cursor.fetchall()
+    length = max((key for key, _ in product_keys), default=-1) + 1
+    encoded_ids = {key: product_id.encode() for key, product_id in product_keys}
+    product_id_offsets = np.zeros(length + 1, dtype=np.int64)
+    for key, encoded_id in encoded_ids.items():
+        product_id_offsets[key + 1] = len(encoded_id)
+    np.cumsum(product_id_offsets, out=product_id_offsets)
+    product_id_data = np.frombuffer(b''.join(encoded_ids.get(key, b'') for key in range(length)), dtype=np.uint8)
+    product_id_order = np.array(sorted(encoded_ids, key=lambda key: encoded_ids[key].decode()), dtype=np.int32)
+
+    # group ids are numbered again from 0, so they can be used as index
+    cursor.execute('SELECT group_id, product_ids FROM content_group ORDER BY group_id')
+    groups = cursor.fetchall()
+    group_index = {group_id: i for i, (group_id, _) in enumerate(groups)}
+    group_offsets, group_products = get_offsets({i: product_ids for i, (_, product_ids) in enumerate(groups)}, len(groups))
+    product_group = np.full(length, -1, dtype=np.int32)
+    cursor.execute('SELECT product_id, group_id FROM content_rule')
+    for key, group_id in cursor.fetchall():
+        if key < length and group_id in group_index:
+            product_group[key] = group_index[group_id]
+
+    cursor.execute('SELECT product_id, recommended_product_ids FROM co_purchase')
+    co_purchase = {key: product_ids or [] for key, product_ids in cursor.fetchall() if key < length}
+    co_purchase_offsets, co_purchase_products = get_offsets(co_purchase, length)
+    return {
+        "product_id_offsets": product_id_offsets,
+        "product_id_data": product_id_data,
+        "product_id_order": product_id_order,
+        "product_group": product_group,
+        "group_offsets": group_offsets,
+        "group_products": group_products,
+        "co_purchase_offsets": co_purchase_offsets,
+        "co_purchase_products": co_purchase_products,
+    }
+
+def align(size):
+    """Round a size up to a multiple of ALIGNMENT
+
+    @params
+    size: amount of bytes
+
+    return: aligned amount of bytes
+    """
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+def write_snapshot(path, arrays, version):
+    """Write arrays to a snapshot file, replacing an existing file atomically
+
+    The file is written next to path first and renamed when it is complete,
+    so a reader never sees a half written snapshot.
+
+    @params
+    path: path of the snapshot file
+    arrays: dict of {name: numpy array}
+    version: version saved in the header, eg. the content version (see recommendation_cache.py)
+    """
+    header = {"format_version": FORMAT_VERSION, "version": version, "created": time.time(), "arrays": {}}
+    relative_offsets = {}
+    size = 0
+    for name, array in arrays.items():
+        relative_offsets[name] = size
+        size += align(array.nbytes)
+    # the arrays start behind the header, which gets longer when the offsets do
+    start = 0
+    while True:
+        for name, array in arrays.items():
+            header["arrays"][name] = {"dtype": array.dtype.str, "length": len(array), "offset": start + relative_offsets[name]}
+        encoded_header = json.dumps(header).encode()
+        if align(len(MAGIC) + 8 + len(encoded_header)) <= start:
+            break
+        start = align(len(MAGIC) + 8 + len(encoded_header))
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'wb') as file:
+        file.write(MAGIC)
+        file.write(struct.pack('<Q', len(encoded_header)))
+        file.write(encoded_header)
+        for name, array in arrays.items():
+            file.seek(header["arrays"][name]["offset"])
+            file.write(np.ascontiguousarray(array).tobytes())
+        file.truncate(start + size)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
+
+def export_snapshot(cursor, path):
+    """Export the recommendation data of PostgreSQL to a snapshot file
+
+    @params
+    cursor: PostgreSQL cursor
+    path: path of the snapshot file
+
+    return: version of the snapshot, the current content version
+    """
+    version = cache.get_versions(cursor).get("content", 0)
+    write_snapshot(path, get_snapshot_arrays(cursor), version)
+    return version
+
+if __name__ == '__main__':
+    # Establish connection with PostgreSQL
+    connection = connect.connect_db(host='localhost', database='opisop_sql', user='postgres', password='postgres')
+    cursor = connection.cursor()
+
+    # export the snapshot, running services pick it up within CHECK_INTERVAL seconds
+    print(f"exported snapshot version {export_snapshot(cursor, 'recommendations.snapshot')}")
+
+    cursor.close()
+    connection.close()
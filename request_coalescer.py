@@ -0,0 +1,101 @@
+###################################################################
+#                                                                 #
+#   Combines concurrent requests into batch queries, used by the  #
+#   AsyncRecommendationService in async_recommendation_engine.py  #
+#                                                                 #
+###################################################################
+
+import asyncio
+
+# Seconds requests are collected before they are sent as one batch query
+BATCH_WINDOW = 0.002
+
+# Maximum amount of ids per batch query, a full batch is sent without waiting for the window
+MAX_BATCH_SIZE = 500
+
+class Coalescer:
+    """Combine concurrent requests into batch queries
+
+    Requests for an id that is already being fetched wait for that fetch (singleflight).
+    Other requests arriving within window seconds are fetched together with one call of fetch_batch.
+
+    @params
+    fetch_batch: async function getting a list of ids and returning a dict of {id: result}
+    window: seconds requests are collected before fetching them (DEFAULT=BATCH_WINDOW)
+    max_batch_size: maximum amount of ids per fetch_batch call (DEFAULT=MAX_BATCH_SIZE)
+    """
+    def __init__(self, fetch_batch, window=BATCH_WINDOW, max_batch_size=MAX_BATCH_SIZE):
+        self.fetch_batch = fetch_batch
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.in_flight = {}
+        self.pending = []
+        self.timer = None
+        self.tasks = set()
+        self.loop = None
+
+    async def get(self, id):
+        """Get the result for one id
+
+        @params
+        id: the id to fetch
+
+        return: result of fetch_batch for id, None if fetch_batch returned nothing for it
+        """
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            # futures and the timer of a previous event loop (eg. of an earlier asyncio.run()) can not be awaited in this one
+            self.loop = loop
+            self.in_flight = {}
+            self.pending = []
+            self.timer = None
+        future = self.in_flight.get(id)
+        if future is None:
+            future = loop.create_future()
+            self.in_flight[id] = future
+            self.pending.append(id)
+            if len(self.pending) >= self.max_batch_size:
+                self.flush()
+            elif self.timer is None:
+                self.timer = loop.call_later(self.window, self.flush)
+        # shield, so one cancelled request does not cancel the fetch for the requests waiting with it
+        return await asyncio.shield(future)
+
+    def flush(self):
+        """Start fetching all collected ids"""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        ids, self.pending = self.pending, []
+        if ids:
+            task = asyncio.get_running_loop().create_task(self.fetch(ids))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def fetch(self, ids):
+        """Fetch a batch of ids and hand the results to the waiting requests
+
+        @params
+        ids: list of ids
+        """
+        in_flight = self.in_flight # get() replaces it when the event loop changes
+        try:
+            results = await self.fetch_batch(ids)
+        except Exception as error:
+            for id in ids:
+                future = in_flight.pop(id)
+                if not future.done():
+                    future.set_exception(error)
+                    future.exception() # the error is raised to the requests, not logged as never retrieved
+            return
+        except BaseException:
+            # cancelled, eg. when the event loop shuts down, the waiting requests are cancelled as well
+            for id in ids:
+                future = in_flight.pop(id)
+                if not future.done():
+                    future.cancel()
+            raise
+        for id in ids:
+            future = in_flight.pop(id)
+            if not future.done():
+                future.set_result(results.get(id))
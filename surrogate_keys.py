@@ -0,0 +1,105 @@
+#####################################################################
+#                                                                   #
+#   Integer keys for the product, session and profile ids          #
+#                                                                   #
+#   The ids from MongoDB are long strings. Every id gets an INT     #
+#   key in a mapping table (eg. product_keys), and all other        #
+#   tables store that key. Ids are only translated back to          #
+#   strings when recommendations leave recommendation_engine.py.    #
+#                                                                   #
+#####################################################################
+
+import instrumentation as inst
+
+# Mapping table and key column per kind of id, the string id is saved in source_id
+KEY_TABLES = {
+    "product": ("product_keys", "product_id"),
+    "session": ("session_keys", "session_id"),
+    "profile": ("profile_keys", "profile_id"),
+}
+
+def load_keys(cursor, kind):
+    """Get all keys of a kind of id as a hash map
+
+    @params
+    cursor: PostgreSQL cursor
+    kind: kind of id, a key of KEY_TABLES
+
+    return: dict of {source_id: key}
+    """
+    table, column = KEY_TABLES[kind]
+    cursor.execute(f'SELECT source_id, {column} FROM {table}')
+    inst.metrics.round_trip('postgresql')
+    return dict(cursor.fetchall())
+
+def get_keys(cursor, kind, source_ids, assign=False):
+    """Get the keys of some ids
+
+    @params
+    cursor: PostgreSQL cursor
+    kind: kind of id, a key of KEY_TABLES
+    source_ids: iterable of string ids
+    assign: give ids without key a new key (DEFAULT=False)
+
+    return: dict of {source_id: key}, without ids that have no key
+    """
+    table, column = KEY_TABLES[kind]
+    source_ids = list({source_id for source_id in source_ids if source_id is not None})
+    if not source_ids:
+        return {}
+    if assign:
+        cursor.execute(f'INSERT INTO {table} (source_id) SELECT unnest(%s::varchar[]) ON CONFLICT (source_id) DO NOTHING', [source_ids])
+        inst.metrics.round_trip('postgresql')
+    cursor.execute(f'SELECT source_id, {column} FROM {table} WHERE source_id = ANY(%s::varchar[])', [source_ids])
+    inst.metrics.round_trip('postgresql')
+    return dict(cursor.fetchall())
+
+def key_assigner(cursor, kind, index):
+    """Make a pipeline stage replacing ids with their keys, new ids get a new key
+
+    The keys are kept in memory, so only ids that are new for this stage are sent to PostgreSQL.
+    Datapoints without id are dropped.
+
+    @params
+    cursor: PostgreSQL cursor
+    kind: kind of id, a key of KEY_TABLES
+    index: index of the id in each datapoint
+
+    return: function encoding one batch, for fill_database_table.filter_batches()
+    """
+    key_map = load_keys(cursor, kind)
+    def assign(batch):
+        new_ids = [datapoint[index] for datapoint in batch if datapoint[index] is not None and datapoint[index] not in key_map]
+        if new_ids:
+            key_map.update(get_keys(cursor, kind, new_ids, assign=True))
+        encoded_batch = []
+        for datapoint in batch:
+            if datapoint[index] is None:
+                continue
+            datapoint[index] = key_map[datapoint[index]]
+            encoded_batch.append(datapoint)
+        return encoded_batch
+    return assign
+
+def encode_batch(cursor, kind, batch, index, assign=False):
+    """Replace the ids in a batch with their keys, without loading all keys
+
+    Used by sync_database.py, where only a few ids change. Datapoints of which the id has no key are dropped.
+
+    @params
+    cursor: PostgreSQL cursor
+    kind: kind of id, a key of KEY_TABLES
+    batch: list of datapoints
+    index: index of the id in each datapoint
+    assign: give ids without key a new key (DEFAULT=False)
+
+    return: list of encoded datapoints
+    """
+    key_map = get_keys(cursor, kind, [datapoint[index] for datapoint in batch], assign)
+    encoded_batch = []
+    for datapoint in batch:
+        key = key_map.get(datapoint[index])
+        if key is not None:
+            datapoint[index] = key
+            encoded_batch.append(datapoint)
+    return encoded_batch
@@ -0,0 +1,201 @@
+#####################################################################
+#                                                                   #
+#   Use this file to sync changes from MongoDB into PostgreSQL      #
+#                                                                   #
+#   Instead of filling all tables again, only documents that are    #
+#   new or changed since the last sync are read and upserted.       #
+#   The first sync of a collection reads all of its documents.      #
+#                                                                   #
+#####################################################################
+
+from bson import json_util
+
+import MongoDB.session as ses
+import MongoDB.read_collection as read
+import PostgreSQL.connect_db as connect
+import PostgreSQL.insert as ins
+import fill_database_table as fill
+import content_rule
+import co_purchase
+import recommendation_cache as cache
+import surrogate_keys as keys
+import instrumentation as inst
+
+# The field each collection is synced on, only documents with a higher value than the last sync are read.
+# ObjectIds only increase for new documents, use an update field (eg. a last changed date)
+# to pick up changed documents or for collections without ObjectId _ids.
+SYNC_COLLECTIONS = {
+    "products": "_id",
+    "visitors": "_id",
+    "sessions": "_id",
+}
+
+def get_watermark(cursor, collection_name):
+    """Get the last synced value of a collection
+
+    @params
+    cursor: PostgreSQL cursor
+    collection_name: name of the MongoDB collection
+
+    return: last synced value, None if the collection was never synced
+    """
+    cursor.execute('SELECT watermark FROM sync_state WHERE collection = %s', [collection_name])
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return json_util.loads(row[0])["value"]
+
+def save_watermark(cursor, collection_name, watermark):
+    """Save the last synced value of a collection
+
+    @params
+    cursor: PostgreSQL cursor
+    collection_name: name of the MongoDB collection
+    watermark: last synced value
+    """
+    cursor.execute(
+    '''INSERT INTO sync_state (collection, watermark) VALUES (%s, %s)
+        ON CONFLICT (collection) DO UPDATE SET watermark = EXCLUDED.watermark''',
+        [collection_name, json_util.dumps({"value": watermark})]
+    )
+
+def read_changes(collection, labels, state, filters=None, batch_size=ins.BATCH_SIZE):
+    """Read the documents changed since the last sync in batches
+
+    The highest value of the sync field that has been read is kept in state["watermark"].
+
+    @params
+    collection: MongoDB collection
+    labels: list containing the labels of the info looked for in the documents
+    state: dict with the sync "field" and the "watermark" of the last sync
+    filters: OPTIONAL extra mongoDB query the documents have to match
+    batch_size: amount of documents per batch
+
+    return: generator of batches of information, corresponding to the labels
+    """
+    query = dict(filters or {})
+    if state["watermark"] is not None:
+        query[state["field"]] = {'$gt': state["watermark"]}
+    for batch in read.iter_collection_information(collection, labels + [state["field"]], query, batch_size=batch_size):
+        for datapoint in batch:
+            value = datapoint.pop()
+            if value is not None and (state["watermark"] is None or value > state["watermark"]):
+                state["watermark"] = value
+        yield batch
+
+def sync_products(mongo_database, cursor, state, batch_size=ins.BATCH_SIZE):
+    """Upsert changed products
+
+    @params
+    mongo_database: a connection to a MongoDB database
+    cursor: PostgreSQL cursor
+    state: dict with the sync "field" and "watermark", see read_changes()
+    batch_size: amount of documents per batch
+
+    return: set of (brand, category, sub_category) groups the changed products left or joined
+    """
+    product_collection = ses.get_collection(mongo_database, "products")
+    product_collection_labels = ["_id", "brand", "category", "sub_category", "herhaalaankopen", "fast_mover", ["properties", "stock"], ["properties", "discount"]]
+    product_table_labels =  ['product_id', 'brand', 'category', 'sub_category', 'repeat_product', 'fast_mover', 'stock', 'discount']
+    convert_batch = fill.compile_conversions([[0, "string"], [6, "int"]])
+    groups = set()
+    for batch in read_changes(product_collection, product_collection_labels, state, batch_size=batch_size):
+        batch = keys.encode_batch(cursor, "product", convert_batch(batch), 0, assign=True)
+        cursor.execute('SELECT brand, category, sub_category FROM product WHERE product_id = ANY(%s)', [[datapoint[0] for datapoint in batch]])
+        groups.update(cursor.fetchall())
+        groups.update((datapoint[1], datapoint[2], datapoint[3]) for datapoint in batch)
+        ins.upsert_data(cursor, "product", batch, product_table_labels, ["product_id"], batch_size=batch_size)
+    return groups
+
+def sync_visitors(mongo_database, cursor, state, batch_size=ins.BATCH_SIZE):
+    """Upsert the profiles and replace the history of changed visitors
+
+    @params
+    mongo_database: a connection to a MongoDB database
+    cursor: PostgreSQL cursor
+    state: dict with the sync "field" and "watermark", see read_changes()
+    batch_size: amount of documents per batch
+    """
+    visitors_collection = ses.get_collection(mongo_database, "visitors")
+    visitors_collection_labels = ["_id", "buids", "previously_recommended", ["recommendations", "viewed_before"]]
+    for batch in read_changes(visitors_collection, visitors_collection_labels, state, batch_size=batch_size):
+        batch = keys.encode_batch(cursor, "profile", fill.filter_data(batch, 0, "string"), 0, assign=True)
+        profiles_data = fill.filter_profiles([[datapoint[0], datapoint[1]] for datapoint in batch])
+        ins.upsert_data(cursor, "profiles", profiles_data, ['BUID', 'profile_id'], ['BUID'], batch_size=batch_size)
+        history_data = fill.filter_history([[datapoint[0], datapoint[2], datapoint[3]] for datapoint in batch])
+        history_data = keys.encode_batch(cursor, "product", history_data, 1)
+        cursor.execute('DELETE FROM history WHERE profile_id = ANY(%s)', [[datapoint[0] for datapoint in batch]])
+        fill.insert_data(cursor, "history", history_data, ['profile_id', 'product_id', 'history_type'], batch_size=batch_size)
+
+def sync_sessions(mongo_database, cursor, state, batch_size=ins.BATCH_SIZE):
+    """Upsert changed sale sessions and replace their orders
+
+    Sessions are linked to the profiles that are already in PostgreSQL, so sync visitors first.
+    The orders of new sessions are added to the co_purchase data.
+
+    @params
+    mongo_database: a connection to a MongoDB database
+    cursor: PostgreSQL cursor
+    state: dict with the sync "field" and "watermark", see read_changes()
+    batch_size: amount of documents per batch
+    """
+    sessions_collection = ses.get_collection(mongo_database, "sessions")
+    sessions_collection_labels = ["_id", "buid", "has_sale", ["order", "products"]]
+    co_purchase_product_ids = set()
+    for batch in read_changes(sessions_collection, sessions_collection_labels, state, filters={'has_sale' : {'$eq' : True}}, batch_size=batch_size):
+        batch = fill.filter_data(batch, 0, "string")
+        sessions_data = [[datapoint[0], datapoint[1][0] if isinstance(datapoint[1], list) else datapoint[1]] for datapoint in batch]
+        cursor.execute('SELECT BUID, profile_id FROM profiles WHERE BUID = ANY(%s)', [[datapoint[1] for datapoint in sessions_data]])
+        sessions_data = fill.link_sessions_to_profile(dict(cursor.fetchall()), sessions_data)
+        session_keys = keys.get_keys(cursor, "session", [datapoint[0] for datapoint in sessions_data], assign=True)
+        sessions_data = [[session_keys[datapoint[0]], datapoint[1]] for datapoint in sessions_data]
+        ins.upsert_data(cursor, "sessions", sessions_data, ['session_id', 'profile_id'], ['session_id'], batch_size=batch_size)
+        session_ids = {datapoint[0] for datapoint in sessions_data}
+        ordered_data = fill.filter_orders([[datapoint[0], datapoint[2], datapoint[3]] for datapoint in batch])
+        ordered_data = [[session_keys[datapoint[0]], datapoint[1]] for datapoint in ordered_data if datapoint[0] in session_keys]
+        ordered_data = keys.encode_batch(cursor, "product", ordered_data, 1)
+        cursor.execute('DELETE FROM ordered WHERE session_id = ANY(%s)', [list(session_ids)])
+        fill.insert_data(cursor, "ordered", ordered_data, ['session_id', 'product_id'], batch_size=batch_size)
+        co_purchase_product_ids |= co_purchase.add_sessions(cursor, session_ids)
+    if co_purchase_product_ids:
+        co_purchase.refresh_neighbours(cursor, co_purchase_product_ids)
+
+def sync(mongo_database, cursor, batch_size=ins.BATCH_SIZE):
+    """Sync all collections in SYNC_COLLECTIONS into PostgreSQL
+
+    Products are synced first, so the orders and history of other collections can refer to them.
+    Content rule groups of changed products are generated again
+    and the cached recommendations of running services are invalidated.
+    Everything happens in the transaction of the cursor, commit to apply it.
+
+    @params
+    mongo_database: a connection to a MongoDB database
+    cursor: PostgreSQL cursor
+    batch_size: amount of documents per batch
+    """
+    syncers = [("products", sync_products), ("visitors", sync_visitors), ("sessions", sync_sessions)]
+    groups = set()
+    for collection_name, syncer in syncers:
+        state = {"field": SYNC_COLLECTIONS[collection_name], "watermark": get_watermark(cursor, collection_name)}
+        last_watermark = state["watermark"]
+        print(f"syncing {collection_name}")
+        changed_groups = syncer(mongo_database, cursor, state, batch_size=batch_size)
+        if changed_groups:
+            groups.update(changed_groups)
+        if state["watermark"] != last_watermark:
+            save_watermark(cursor, collection_name, state["watermark"])
+    content_rule.refresh_content_groups(cursor, groups)
+    cache.bump_version(cursor, "content")
+    cache.bump_version(cursor, "profile")
+
+if __name__ == '__main__':
+    # Establish Mongo and Postgres connections, be sure all the variables correspond to your current information.
+    connection = connect.connect_db(host='localhost', database='opisop_sql', user='postgres', password='postgres')
+    cursor = connection.cursor()
+    mongo_database = ses.get_database(client=ses.get_client(host="Localhost", port=27017), database_name="opisop")
+
+    sync(mongo_database, cursor)
+
+    cursor.close()
+    connection.commit()
+    inst.metrics.print_summary("sync")
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+# the modules are run as scripts from the repository root, make them importable for the tests
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class FakeCursor:
+    """Cursor returning prepared results, one list of rows per executed statement"""
+    def __init__(self, results):
+        self.results = list(results)
+        self.rows = None
+
+    def execute(self, query, vars=None):
+        self.rows = self.results.pop(0)
+
+    def fetchall(self):
+        return self.rows
+
+@pytest.fixture
+def fake_cursor():
+    """Make a FakeCursor from a list of results, eg. fake_cursor([rows of the first statement, ...])"""
+    return FakeCursor
@@ -0,0 +1,57 @@
+import random
+
+import collaborative_filtering as cf
+
+def brute_force(orders, ranked_product_ids, profile_id, comparative_user_amount, recommendation_amount):
+    """Recommendations computed like the querry in recommendation_engine.get_profile_recommendations()
+
+    return: list of product ids, None when users with equal overlap make the selected users ambiguous
+    """
+    own_products = {product_id for user, product_id, count in orders if user == profile_id}
+    totals = {}
+    for user, product_id, count in orders:
+        if user != profile_id and product_id in own_products:
+            totals[user] = totals.get(user, 0) + count
+    ranked_users = sorted(totals, key=lambda user: -totals[user])
+    if len(ranked_users) > comparative_user_amount and totals[ranked_users[comparative_user_amount-1]] == totals[ranked_users[comparative_user_amount]]:
+        return None
+    users = set(ranked_users[:comparative_user_amount])
+    rank = {product_id: i for i, product_id in enumerate(ranked_product_ids)}
+    frequency = {}
+    for user, product_id, count in orders:
+        if user in users and product_id not in own_products and product_id in rank:
+            frequency[product_id] = frequency.get(product_id, 0) + count
+    return sorted(frequency, key=lambda product_id: (-frequency[product_id], rank[product_id]))[:recommendation_amount]
+
+def get_orders(generator, profiles, products):
+    orders = {}
+    for _ in range(generator.randint(1, 80)):
+        key = (f'profile{generator.randrange(profiles)}', f'product{generator.randrange(products)}')
+        orders[key] = orders.get(key, 0) + generator.randint(1, 3)
+    return [(profile_id, product_id, count) for (profile_id, product_id), count in orders.items()]
+
+def test_recommend_matches_querry(fake_cursor):
+    generator = random.Random(10)
+    compared = 0
+    for _ in range(300):
+        profiles, products = generator.randint(2, 15), generator.randint(2, 25)
+        orders = get_orders(generator, profiles, products)
+        # some ordered products are missing from the product table
+        ranked_product_ids = [f'product{i}' for i in range(products) if generator.random() < 0.9]
+        generator.shuffle(ranked_product_ids)
+        model = cf.build_profile_model(fake_cursor([orders, [(product_id,) for product_id in ranked_product_ids]]))
+        profile_id = f'profile{generator.randrange(profiles + 1)}'
+        comparative_user_amount, recommendation_amount = generator.randint(1, 5), generator.randint(1, 10)
+        expected = brute_force(orders, ranked_product_ids, profile_id, comparative_user_amount, recommendation_amount)
+        if expected is None:
+            continue
+        assert model.recommend(profile_id, comparative_user_amount, recommendation_amount) == expected
+        compared += 1
+    assert compared > 100
+
+def test_save_and_load_profile_model(tmp_path, fake_cursor):
+    orders = [('profile0', 'product0', 2), ('profile0', 'product1', 1), ('profile1', 'product0', 1), ('profile1', 'product2', 3)]
+    model = cf.build_profile_model(fake_cursor([orders, [('product2',), ('product1',), ('product0',)]]))
+    cf.save_profile_model(model, tmp_path / 'profile_model.npz')
+    loaded = cf.load_profile_model(tmp_path / 'profile_model.npz')
+    assert loaded.recommend('profile0', 1, 5) == model.recommend('profile0', 1, 5) == ['product2']
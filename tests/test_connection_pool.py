@@ -0,0 +1,68 @@
+import threading
+import time
+
+import pytest
+from psycopg2.pool import PoolError
+
+import PostgreSQL.connect_db as connect
+
+class FakeCursor:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, query, vars=None):
+        pass
+
+class FakeConnection:
+    closed = 0
+
+    def cursor(self):
+        return FakeCursor()
+
+    def rollback(self):
+        pass
+
+class FakeThreadedConnectionPool:
+    """Stand-in for psycopg2's ThreadedConnectionPool, handing out FakeConnections"""
+    def __init__(self, min_connections, max_connections, **connection_settings):
+        self.connections = [FakeConnection() for _ in range(max_connections)]
+
+    def getconn(self):
+        return self.connections.pop()
+
+    def putconn(self, connection, close=False):
+        self.connections.append(connection)
+
+    def closeall(self):
+        self.connections = []
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(connect, 'ThreadedConnectionPool', FakeThreadedConnectionPool)
+    return lambda **settings: connect.ConnectionPool('localhost', 'opisop_sql', 'postgres', 'postgres', max_connections=1, **settings)
+
+def test_exhausted_pool_waits_for_returned_connection(pool):
+    connection_pool = pool()
+    connection = connection_pool.getconn()
+    returner = threading.Timer(0.2, connection_pool.putconn, [connection])
+    returner.start()
+    start = time.monotonic()
+    assert connection_pool.getconn() is connection
+    assert time.monotonic() - start >= 0.15
+    returner.join()
+
+def test_exhausted_pool_times_out(pool):
+    connection_pool = pool(timeout=0.1)
+    connection_pool.getconn()
+    with pytest.raises(PoolError):
+        connection_pool.getconn()
+
+def test_connection_block_returns_connection(pool):
+    connection_pool = pool(timeout=0.1)
+    with pytest.raises(ValueError), connection_pool.connection():
+        raise ValueError
+    with connection_pool.connection() as connection:
+        assert isinstance(connection, FakeConnection)
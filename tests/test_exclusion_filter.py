@@ -0,0 +1,43 @@
+import numpy as np
+
+import exclusion_filter as exclusion
+import recommendation_engine as engine
+
+def get_exclusion_filter():
+    product_ids = np.array([f'product{key}' for key in range(30)])
+    return exclusion.ExclusionFilter(['profile1', 'profile2'], np.array([0, 3, 3]), np.array([1, 4, 7], dtype=np.int32), product_ids)
+
+def get_service(fetch_content_recommendations):
+    service = engine.RecommendationService.__new__(engine.RecommendationService)
+    service.exclusion_filter = get_exclusion_filter()
+    service.fetch_content_recommendations = fetch_content_recommendations
+    return service
+
+def test_excluded_products():
+    excluded = get_exclusion_filter().excluded('profile1')
+    assert len(excluded) == 3
+    assert 'product4' in excluded
+    assert 'product2' not in excluded
+    assert 'unknown' not in excluded
+    assert not get_exclusion_filter().excluded('profile2')
+    assert not get_exclusion_filter().excluded(None)
+
+def test_fetch_amount_does_not_depend_on_history():
+    fetch_amounts = []
+    def fetch_content_recommendations(product_id, amount):
+        fetch_amounts.append(amount)
+        return [f'product{key}' for key in range(1, amount + 1)]
+    service = get_service(fetch_content_recommendations)
+    assert service.get_content_recommendations('product0', 3, 'profile1') == ['product2', 'product3', 'product5']
+    assert service.get_content_recommendations('product0', 3, None) == ['product1', 'product2', 'product3']
+    assert fetch_amounts == [3 + exclusion.EXCLUSION_MARGIN, 3]
+
+def test_fetches_more_when_too_few_are_left(monkeypatch):
+    monkeypatch.setattr(exclusion, 'EXCLUSION_MARGIN', 1)
+    fetch_amounts = []
+    def fetch_content_recommendations(product_id, amount):
+        fetch_amounts.append(amount)
+        return ['product1', 'product4', 'product7', 'product2', 'product3'][:amount]
+    service = get_service(fetch_content_recommendations)
+    assert service.get_content_recommendations('product0', 2, 'profile1') == ['product2', 'product3']
+    assert fetch_amounts == [3, 5]
@@ -0,0 +1,62 @@
+import pytest
+
+import recommendation_cache as cache
+import recommendation_engine as engine
+import recommendation_snapshot as snapshot
+
+def get_cursor(fake_cursor, version):
+    """Cursor with the results export_snapshot() reads: versions, product keys, groups, content rule and co purchase"""
+    return fake_cursor([
+        [("content", version), ("profile", 1)],
+        [(0, 'b'), (1, 'a'), (2, 'long-product-id'), (4, 'd')], # key 3 is unused
+        [(7, [2, 0, 1]), (9, [4])],
+        [(0, 7), (1, 7), (2, 7), (4, 9)],
+        [(0, [4, 2]), (2, None), (4, [0])],
+    ])
+
+def test_export_and_open_snapshot(tmp_path, fake_cursor):
+    path = str(tmp_path / 'recommendations.snapshot')
+    assert snapshot.export_snapshot(get_cursor(fake_cursor, 3), path) == 3
+    current_snapshot = snapshot.SnapshotFile(path).get()
+    assert current_snapshot.version == 3
+    for name, array in current_snapshot.header["arrays"].items():
+        assert array["offset"] % snapshot.ALIGNMENT == 0
+    assert current_snapshot.get_key('long-product-id') == 2
+    assert current_snapshot.get_key('c') is None
+    assert current_snapshot.get_content_recommendations('b', 5) == ['long-product-id', 'a']
+    assert current_snapshot.get_content_recommendations('long-product-id', 1) == ['b']
+    assert current_snapshot.get_content_recommendations('d', 5) == []
+    assert current_snapshot.get_content_recommendations('unknown', 5) == []
+    assert current_snapshot.get_co_purchase_recommendations('b', 5) == ['d', 'long-product-id']
+    assert current_snapshot.get_co_purchase_recommendations('b', 1) == ['d']
+    assert current_snapshot.get_co_purchase_recommendations('long-product-id', 5) == []
+    assert current_snapshot.get_co_purchase_recommendations('a', 5) == []
+
+def test_snapshot_file_picks_up_new_export(tmp_path, fake_cursor):
+    path = str(tmp_path / 'recommendations.snapshot')
+    snapshot.export_snapshot(get_cursor(fake_cursor, 3), path)
+    snapshot_file = snapshot.SnapshotFile(path, check_interval=0)
+    old_snapshot = snapshot_file.get()
+    snapshot.export_snapshot(get_cursor(fake_cursor, 4), path)
+    assert snapshot_file.get().version == 4
+    # requests still holding the old snapshot can keep using it
+    assert old_snapshot.version == 3
+    assert old_snapshot.get_content_recommendations('a', 5) == ['long-product-id', 'b']
+
+def test_refuses_other_files(tmp_path):
+    path = tmp_path / 'other.snapshot'
+    path.write_bytes(b'not a snapshot' * 10)
+    with pytest.raises(ValueError):
+        snapshot.RecommendationSnapshot(str(path))
+
+def test_service_does_not_use_stale_snapshot(tmp_path, fake_cursor):
+    path = str(tmp_path / 'recommendations.snapshot')
+    snapshot.export_snapshot(get_cursor(fake_cursor, 3), path)
+    service = engine.RecommendationService.__new__(engine.RecommendationService)
+    service.snapshot = snapshot.SnapshotFile(path)
+    service.content_cache = cache.RecommendationCache(10, 60)
+    service.content_cache.set_version(3)
+    assert service.get_snapshot().version == 3
+    # content_rule.py regenerated the content, but no new snapshot was exported
+    service.content_cache.set_version(4)
+    assert service.get_snapshot() is None
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+import request_coalescer as coalesce
+
+class FakeFetch:
+    """fetch_batch recording its calls, returning id * 2 for the ids below missing_from"""
+    def __init__(self, delay=0.01, error=None, missing_from=None):
+        self.calls = []
+        self.delay = delay
+        self.error = error
+        self.missing_from = missing_from
+
+    async def __call__(self, ids):
+        self.calls.append(list(ids))
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return {id: id * 2 for id in ids if self.missing_from is None or id < self.missing_from}
+
+def test_same_id_shares_one_fetch():
+    fetch = FakeFetch()
+    coalescer = coalesce.Coalescer(fetch, window=0.001)
+    async def run():
+        return await asyncio.gather(*[coalescer.get(1) for _ in range(5)])
+    assert asyncio.run(run()) == [2] * 5
+    assert fetch.calls == [[1]]
+
+def test_requests_within_window_are_fetched_together():
+    fetch = FakeFetch()
+    coalescer = coalesce.Coalescer(fetch, window=0.05)
+    async def run():
+        return await asyncio.gather(*[coalescer.get(id) for id in range(4)])
+    assert asyncio.run(run()) == [0, 2, 4, 6]
+    assert fetch.calls == [[0, 1, 2, 3]]
+
+def test_full_batch_is_fetched_without_waiting():
+    fetch = FakeFetch()
+    coalescer = coalesce.Coalescer(fetch, window=10, max_batch_size=3)
+    async def run():
+        return await asyncio.wait_for(asyncio.gather(*[coalescer.get(id) for id in range(3)]), timeout=1)
+    assert asyncio.run(run()) == [0, 2, 4]
+    assert fetch.calls == [[0, 1, 2]]
+
+def test_error_reaches_every_request():
+    coalescer = coalesce.Coalescer(FakeFetch(error=ValueError('fetch failed')), window=0.001)
+    async def run():
+        return await asyncio.gather(*[coalescer.get(id) for id in [1, 1, 2]], return_exceptions=True)
+    results = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert coalescer.in_flight == {}
+
+def test_missing_id_gives_none():
+    coalescer = coalesce.Coalescer(FakeFetch(missing_from=2), window=0.001)
+    async def run():
+        return await asyncio.gather(coalescer.get(1), coalescer.get(5))
+    assert asyncio.run(run()) == [2, None]
+
+def test_cancelled_request_does_not_cancel_the_others():
+    fetch = FakeFetch(delay=0.05)
+    coalescer = coalesce.Coalescer(fetch, window=0.001)
+    async def run():
+        cancelled = asyncio.ensure_future(coalescer.get(1))
+        waiting = asyncio.ensure_future(coalescer.get(1))
+        await asyncio.sleep(0.01)
+        cancelled.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        return await waiting
+    assert asyncio.run(run()) == 2
+    assert fetch.calls == [[1]]
+
+def test_cancelled_fetch_does_not_leave_requests_waiting():
+    coalescer = coalesce.Coalescer(FakeFetch(delay=10), window=0.001)
+    async def shut_down_during_fetch():
+        asyncio.ensure_future(coalescer.get(1))
+        await asyncio.sleep(0.05)
+    asyncio.run(shut_down_during_fetch())
+    assert coalescer.in_flight == {}
+    coalescer.fetch_batch = FakeFetch()
+    async def run():
+        return await asyncio.wait_for(coalescer.get(1), timeout=1)
+    assert asyncio.run(run()) == 2